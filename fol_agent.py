@@ -1,25 +1,198 @@
 #!/usr/bin/python
-from collections import deque
+from collections import OrderedDict, deque
+import hashlib
+import heapq
+import itertools
+import math
 import ply.lex as lex
 import ply.yacc as yacc
-from copy import deepcopy
+from array import array
+import bisect
+import mmap
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import struct
 import time
 import re
+import sys
+import weakref
+import zlib
+
+# seconds spent on a single query before giving up and answering FALSE
+TIME_LIMIT = 30
+# worker processes answering queries in parallel, 0 for one per CPU
+QUERY_WORKERS = 1
+# extra seconds granted to a worker past TIME_LIMIT before its query is
+# answered FALSE without it
+QUERY_TIME_GRACE = 5
+# answers remembered across the queries of a run (per worker process), least
+# recently used first out, 0 to disable
+LEMMA_CACHE_SIZE = 4096
+# prover behind resolution(): "given_clause", "parallel", "portfolio", "rete",
+# "datalog", "tabling", "sat" or "bfs"
+RESOLUTION_ENGINE = "given_clause"
+# configurations raced on the same query by the "portfolio" engine, each in
+# its own process, as keyword arguments of resolution()
+PORTFOLIO = [
+    {"engine": "given_clause", "selection": "age_weight"},
+    {"engine": "given_clause", "selection": "unit"},
+    {"engine": "given_clause", "selection": "fifo", "set_of_support": False},
+    {"engine": "given_clause", "selection": "goal_distance", "max_depth": 8},
+]
+# processes sharing the inference of one query with the "parallel" engine,
+# 0 for one per CPU
+INFERENCE_WORKERS = 0
+# with the "parallel" engine, given clauses with fewer candidate pairs than
+# this are resolved by the main process alone
+PARALLEL_MIN_PAIRS = 64
+# order in which waiting clauses are picked: "fifo", "weight", "age_weight",
+# "unit" or "goal_distance"
+CLAUSE_SELECTION = "age_weight"
+# with "age_weight", every AGE_WEIGHT_RATIO-th pick is the oldest clause
+AGE_WEIGHT_RATIO = 5
+# report loading progress on stderr every that many KB sentences, 0 for never
+LOAD_PROGRESS_INTERVAL = 0
+# compiled KB snapshot file: when set, the KB is memory-mapped from it instead
+# of being parsed from the input file; the snapshot is built from the input
+# file first if it does not exist yet or was built from other KB sentences
+KB_SNAPSHOT = None
+# CNF cache file: when set, the clauses of every KB sentence are kept in it
+# by a hash of the sentence text, and unchanged sentences are neither parsed
+# nor converted again on the next run
+CNF_CACHE = None
+# sentence parser: "ply", "recursive_descent", or "checked" to run both and
+# fail on any difference; on malformed input ply's error recovery may still
+# return a predicate (e.g. Q(y,y) for &Q(y,y)) where recursive_descent
+# returns None
+PARSER_BACKEND = "ply"
+# a disjunction whose CNF by distribution would have more clauses than this
+# gets definition predicates for its conjunctive parts, 0 to always distribute
+CNF_DEFINITION_THRESHOLD = 32
+
+class SymbolTable(object):
+    # Compact integer ids for the symbols of the program: predicate names and
+    # constants get positive ids, variables (lower-case names) negative ones,
+    # so the sign of an id tells variables apart without looking at the
+    # name.  Only the base names of variables, without their standardize
+    # counter (e.g. "x" for "x12"), are kept: the id of a variable is
+    # computed from the number of its base name and its counter (see pair),
+    # so the fresh variables of every query do not pile up in the table.
+    def __init__(self):
+        self.ids = {}
+        self.names = [None]
+        self.base_ids = {}
+        self.bases = []
+
+    # return value: the id of name, assigned on first use
+    def code(self, name):
+        id = self.ids.get(name)
+        if id is not None:
+            return id
+        if not name.islower():
+            id = len(self.names)
+            self.names.append(name)
+            self.ids[name] = id
+            return id
+        base = name.rstrip("0123456789")
+        counter = name[len(base):]
+        if counter.startswith("0"):
+            raise ValueError("Not a variable name of this program: %s" % name)
+        if base not in self.base_ids:
+            self.base_ids[base] = len(self.bases)
+            self.bases.append(sys.intern(base))
+        return -1 - pair(self.base_ids[base], int(counter) if counter else 0)
+
+    def name(self, id):
+        if id < 0:
+            (base, counter) = unpair(-1 - id)
+            if counter == 0:
+                return self.bases[base]
+            return sys.intern(self.bases[base] + str(counter))
+        return self.names[id]
+
+    # the name of variable id without its counter
+    def base(self, id):
+        return self.bases[unpair(-1 - id)[0]]
+
+# Szudzik's pairing of two naturals into one, and back
+def pair(x, y):
+    if x < y:
+        return y * y + x
+    return x * x + x + y
+
+def unpair(z):
+    s = math.isqrt(z)
+    if z - s * s < s:
+        return (z - s * s, s)
+    return (s, z - s * s - s)
+
+symbols = SymbolTable()
 
 class Predicate(object):
-    # positive = True
-    # arguments = []
-    # name = ""
-    def __init__(self, name, arguments, positive = True):
-        self.arguments = arguments
-        self.name = name
-        self.positive = positive
-        self.type = "Predicate"
+    # Predicates are immutable and hash-consed: building a predicate with the
+    # same name, arguments and sign returns the existing object, so equality
+    # is an identity check and the hash is computed only once.  codes holds
+    # the symbol ids of the arguments (see SymbolTable), for the inner loops
+    # of unification and matching.
+    __slots__ = ("name", "arguments", "positive", "codes", "_hash", "__weakref__")
+    type = "Predicate"
+    _table = weakref.WeakValueDictionary()
+
+    def __new__(cls, name, arguments, positive = True):
+        return cls._make(sys.intern(name), tuple([sys.intern(arg) for arg in arguments]), positive)
+
+    # arguments must already be a tuple of interned strings
+    @classmethod
+    def _make(cls, name, arguments, positive):
+        key = (name, arguments, positive)
+        self = cls._table.get(key)
+        if self is None:
+            self = object.__new__(cls)
+            object.__setattr__(self, "name", name)
+            object.__setattr__(self, "arguments", arguments)
+            object.__setattr__(self, "positive", positive)
+            object.__setattr__(self, "codes", tuple([symbols.code(arg) for arg in arguments]))
+            object.__setattr__(self, "_hash", hash(key))
+            cls._table[key] = self
+        return self
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Predicate is immutable")
 
     def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+        return self is other
 
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Predicate, (self.name, self.arguments, self.positive))
+
+    def negate(self):
+        return Predicate._make(self.name, self.arguments, not self.positive)
+
+    # apply substitutions, sharing this predicate when none of its arguments
+    # is bound
+    def substitute(self, substitutions):
+        arguments = self.arguments
+        for arg in arguments:
+            if arg in substitutions:
+                break
+        else:
+            return self
+        arguments = tuple([substitutions.get(arg, arg) for arg in arguments])
+        return Predicate._make(self.name, arguments, self.positive)
 
     def __repr__(self):
         if self.positive:
@@ -28,16 +201,42 @@ class Predicate(object):
             return "~" + self.name + "(" + ",".join(self.arguments) + ")"
 
 class Clause(object):
-    # predicates = []
-    def __init__(self, predicates):
-        self.predicates = predicates
-        self.type = "Clause"
+    # Clauses are immutable and hash-consed in the same way as predicates,
+    # keyed by their (ordered) tuple of predicates.
+    __slots__ = ("predicates", "_hash", "__weakref__")
+    type = "Clause"
+    _table = weakref.WeakValueDictionary()
+
+    def __new__(cls, predicates):
+        predicates = tuple(predicates)
+        self = cls._table.get(predicates)
+        if self is None:
+            self = object.__new__(cls)
+            object.__setattr__(self, "predicates", predicates)
+            object.__setattr__(self, "_hash", hash(predicates))
+            cls._table[predicates] = self
+        return self
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Clause is immutable")
 
     def __eq__(self, other):
-        if not isinstance(other, self.__class__ ):
-            return False
-        else:
-            return self.__dict__ == other.__dict__
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (Clause, (self.predicates,))
 
     def __repr__(self):
         or_string = ""
@@ -84,15 +283,41 @@ def t_error(t):
     print("Illegal character '%s'" % t.value[0])
     t.lexer.skip(1)
 
-# Build the lexer
-lexer = lex.lex()
+# signature of the token rules, kept in fol_lextab.py as _lexsignature like
+# yacc keeps _lr_signature in fol_parsetab.py
+def lexerSignature():
+    rules = [(name, value if isinstance(value, str) else value.__doc__)
+             for (name, value) in sorted(globals().items()) if name.startswith("t_")]
+    return hashlib.sha1(repr((tokens, rules)).encode("utf-8")).hexdigest()
+
+# Build the lexer.  The lexer tables are compiled once into fol_lextab.py
+# and loaded from it afterwards; they are rebuilt when the signature of the
+# token rules no longer matches.
+def buildLexer():
+    signature = lexerSignature()
+    try:
+        import fol_lextab
+        if getattr(fol_lextab, "_lexsignature", None) == signature:
+            return lex.lex(optimize=1, lextab=fol_lextab)
+    except ImportError:
+        pass
+    lexer = lex.lex(module=sys.modules[__name__])
+    outputdir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        lexer.writetab("fol_lextab", outputdir)
+        with open(os.path.join(outputdir, "fol_lextab.py"), "a") as f:
+            f.write("_lexsignature = %r\n" % signature)
+    except IOError:
+        pass
+    return lexer
+
+lexer = buildLexer()
 
 
 def p_not_expression(p):
     '''expression : LPAREN NOT expression RPAREN'''
     if not isinstance(p[3], list):
-        p[3].positive = (not p[3].positive)
-        p[0] = p[3]
+        p[0] = p[3].negate()
     else:
         p[0] = ["~", p[3]]
 
@@ -133,592 +358,2978 @@ def p_argument_factor(p):
 def p_error(p):
     print("Syntax error in input!")
 
-# Build the parser
-parser = yacc.yacc()
-
-
-def parseInputFile(input_path):
-
-    with open(input_path, 'r') as f:
-        queries = []
-        knowledge_base = []
-        num_of_queries = int(f.readline().strip())
-        for i in range(num_of_queries):
-            sentence = f.readline().replace(" ", "")
-            queries.append(sentence)
-
-        num_of_kb = int(f.readline().strip())
-        for i in range(num_of_kb):
-            sen = f.readline().replace(" ", "")
-            knowledge_base.append(sen)
-        return (queries, knowledge_base)
-
-
-def isClause(q):
-    if not isinstance(q, list):
-        return True
-    elif q[0] != "|":
-        return False
-    else:
-        for i in range(1, len(q)):
-            if isinstance(q[i], list):
-                return False
-        return True
-
-# i.e. CNF
-def isSentence(q):
-    if not isinstance(q, list):
-        return True
-    elif q[0] != "&":
-        return False
-    else:
-        for i in range(1, len(q)):
-            if not isClause(q[i]):
-                return False
-        return True
-
-def negate_item(item):
-    if isClause(item):
-        if isinstance(item, list):
-            item[0] = "&"
-            for i in range(1, len(item)):
-                item[i].positive = (not item[i].positive)
-        else:
-            item.positive = (not item.positive)
-        return item
-    else:
-        if item[0] == "~":
-            item = item[1]
-            # not OK in [&, A, [~, B]]
-            while isinstance(item, list) and item[0] == "~":
-                item = negate_item(item)
-            return item
-        if item[0] == "&":
-            item[0] = "|"
-            item1 = negate_item(item[1])
-            item2 = negate_item(item[2])
-            return ["|", item1, item2]
-
-        if item[0] == "|":
-            item[0] = "&"
-            item1 = negate_item(item[1])
-            item2 = negate_item(item[2])
-            return ["&", item1, item2]
-
-        if item[0] == "=>":
-            item[0] = "&"
-            item2 = negate_item(item[2])
-            return ["&", item[1], item2]
-
-# step 1: eliminate implication
-def eliminate_implication(result):
-    if isClause(result):
-        return result
-    elif result[0] == "=>":
-        item1 = eliminate_implication(result[1])
-        item1 = negate_item(item1)
-        item2 = eliminate_implication(result[2])
-        return ["|", item1, item2]
-    else:
-        for i in range(1, len(result)):
-            result[i] = eliminate_implication(result[i])
-        return result
-
-
-# step 2: Move NOT inward
-def move_not_inward(result):
-    if isClause(result):
-        return result
-    elif result[0] == "~":
-        return negate_item(result[1])
-    else:
-        for i in range(1, len(result)):
-            result[i] = move_not_inward(result[i])
-        return result
-
-
-# step 3: Distribution OR over AND
-def distribution_or_over_and(result):
-    if isClause(result) or isSentence(result):
+# Build the parser.  The LALR tables are compiled once into fol_parsetab.py
+# and loaded from it afterwards; they are rebuilt automatically when the
+# grammar's signature no longer matches.  No parser.out is written.
+ply_parser = yacc.yacc(debug=False, tabmodule="fol_parsetab")
+
+
+# Tokens of the recursive-descent parser, matching the ply lexer rules above;
+# anything else is an illegal character.
+rd_token_pattern = re.compile(r"=>|[A-z]+|[()&|~,]|[^ \t\n]")
+
+def isFactor(tok):
+    return tok is not None and "A" <= tok[0] <= "z"
+
+class RecursiveDescentParser(object):
+    # Single-pass parser for the same grammar as the ply parser, producing the
+    # same Predicate / nested list output.  Every compound expression is fully
+    # parenthesised, so one token of lookahead decides every rule.  Syntax
+    # errors are reported like p_error and make parse() return None, without
+    # the error recovery of ply, which skips stray leading tokens.  Open
+    # parentheses are kept on an explicit stack rather than by recursion, so
+    # any nesting depth is accepted.
+    def parse(self, data):
+        tokens = []
+        for tok in rd_token_pattern.findall(data):
+            if tok == "=>" or (len(tok) == 1 and tok in "()&|~,") or isFactor(tok):
+                tokens.append(tok)
+            else:
+                print("Illegal character '%s'" % tok)
+        self.tokens = tokens
+        self.pos = 0
+        try:
+            result = self.expression()
+            if self.pos != len(tokens):
+                raise SyntaxError
+        except SyntaxError:
+            print("Syntax error in input!")
+            return None
         return result
 
-    if result[0] == "|":
-        if isClause(result[1]) and isClause(result[2]):
-            value = ["|"]
-
-            if isinstance(result[1], list):
-                value = value + result[1][1:]
+    def peek(self, offset = 0):
+        if self.pos + offset < len(self.tokens):
+            return self.tokens[self.pos + offset]
+        return None
+
+    def expect(self, tok):
+        if self.peek() != tok:
+            raise SyntaxError
+        self.pos = self.pos + 1
+
+    def factor(self):
+        tok = self.peek()
+        if not isFactor(tok):
+            raise SyntaxError
+        self.pos = self.pos + 1
+        return tok
+
+    def predicate(self, positive):
+        name = self.factor()
+        self.expect("(")
+        arguments = [self.factor()]
+        while self.peek() == ",":
+            self.pos = self.pos + 1
+            arguments.append(self.factor())
+        self.expect(")")
+        return Predicate(name, arguments, positive)
+
+    def expression(self):
+        # open parentheses: ("not", None) for ( ~ expression ), ("left",
+        # start) while reading the left operand from token start, and
+        # ("right", (op, left)) while reading the right one
+        stack = []
+        while True:
+            tok = self.peek()
+            if tok == "~":
+                self.pos = self.pos + 1
+                item = self.predicate(False)
+            elif tok != "(":
+                item = self.predicate(True)
             else:
-                value.append(result[1])
+                self.pos = self.pos + 1
+                if self.peek() == "~" and not isFactor(self.peek(1)):
+                    # ( ~ expression ), where the expression is not a predicate
+                    self.pos = self.pos + 1
+                    stack.append(("not", None))
+                else:
+                    stack.append(("left", self.pos))
+                continue
 
-            if isinstance(result[2], list):
-                value = value + result[2][1:]
+            # close the parentheses that item completes
+            while stack:
+                (kind, data) = stack[-1]
+                if kind == "not":
+                    stack.pop()
+                    self.expect(")")
+                    if not isinstance(item, list):
+                        item = item.negate()
+                    else:
+                        item = ["~", item]
+                elif kind == "left":
+                    op = self.peek()
+                    if op == ")" and self.tokens[data] == "~":
+                        # ( ~ P(x) ) is the negation of the predicate P(x)
+                        stack.pop()
+                        self.pos = self.pos + 1
+                        continue
+                    if op not in ("=>", "&", "|"):
+                        raise SyntaxError
+                    self.pos = self.pos + 1
+                    stack[-1] = ("right", (op, item))
+                    break
+                else:
+                    stack.pop()
+                    self.expect(")")
+                    item = [data[0], data[1], item]
             else:
-                value.append(result[2])
+                return item
 
-            return value
 
-        elif isClause(result[1]):
-            item2 = distribution_or_over_and(result[2])
-            if item2[0] == "|":
-                if isinstance(result[1], list):
-                    item2 = item2 + result[1][1:]
-                else:
-                    item2.append(result[1])
-                return item2
-
-            if item2[0] == "&":
-                value = ["&"]
-                for i in range(1, len(item2)):
-                    if isinstance(item2[i], list) and isinstance(result[1], list):
-                        value.append(item2[i] + result[1][1:])
-                    elif isinstance(item2[i], list) and not isinstance(result[1], list):
-                        item2i = deepcopy(item2[i])
-                        item2i.append(result[1])
-                        value.append(item2i)
-                    elif not isinstance(item2[i], list) and isinstance(result[1], list):
-                        result1 = deepcopy(result[1])
-                        result1.append(item2[i])
-                        value.append(result1)
-                    else:
-                        value.append(["|", item2[i], result[1]])
+class CheckedParser(object):
+    # Parses with both backends and fails on any difference.
+    def __init__(self):
+        self.rd_parser = RecursiveDescentParser()
+
+    def parse(self, data):
+        result = ply_parser.parse(data)
+        rd_result = self.rd_parser.parse(data)
+        if result != rd_result:
+            raise ValueError("Parsers disagree on %r: %r != %r" % (data, result, rd_result))
+        return result
 
-                return value
 
-        elif isClause(result[2]):
-            item1 = distribution_or_over_and(result[1])
-            if item1[0] == "|":
-                if isinstance(result[2], list):
-                    item1 = item1 + result[2][1:]
+def make_parser(backend = None):
+    if backend is None:
+        backend = PARSER_BACKEND
+    if backend == "ply":
+        return ply_parser
+    if backend == "recursive_descent":
+        return RecursiveDescentParser()
+    if backend == "checked":
+        return CheckedParser()
+    raise ValueError("Unknown parser backend: %s" % backend)
+
+parser = make_parser()
+
+
+# yield the next count sentences of an open input file
+def readSentences(f, count):
+    for i in range(count):
+        yield f.readline().replace(" ", "")
+
+
+# Convert a parsed sentence to CNF in one post-order traversal driven by an
+# explicit stack, so nesting depth is not bounded by Python's recursion
+# limit.  Each node is visited once with the polarity it occurs under, which
+# removes implications and pushes negations inward on the way down, and
+# nested connectives of the same kind are flattened into one node.  On the
+# way up, every subformula yields its CNF as a list of clauses (lists of
+# literals): a conjunction concatenates the CNFs of its parts, a disjunction
+# takes their cross product (see or_cnf).  Sentences already in CNF take
+# time linear in their size.
+# return value: the clauses of the sentence followed by those of its
+# definitions, as lists of literals
+def sentence2cnf(sentence, threshold = None):
+    if threshold is None:
+        threshold = CNF_DEFINITION_THRESHOLD
+    definitions = []
+    results = []
+    # (node, negated, number of parts when the parts are done, conjunctive)
+    stack = [(sentence, False, None, None)]
+    while stack:
+        (node, negated, parts, conjunctive) = stack.pop()
+        if parts is not None:
+            cnfs = results[len(results) - parts:]
+            del results[len(results) - parts:]
+            cnf = cnfs[0]
+            for other in cnfs[1:]:
+                if conjunctive:
+                    cnf.extend(other)
                 else:
-                    item1.append(result[2])
-                return item1
-
-            if item1[0] == "&":
-                value = ["&"]
-                for i in range(1, len(item1)):
-                    if isinstance(item1[i], list) and isinstance(result[2], list):
-                        value.append(item1[i] + result[2][1:])
-                    elif isinstance(item1[i], list) and not isinstance(result[2], list):
-                        item1i = deepcopy(item1[i])
-                        item1i.append(result[2])
-                        value.append(item1i)
-                    elif not isinstance(item1[i], list) and isinstance(result[2], list):
-                        result2 = deepcopy(result[2])
-                        result2.append(item1[i])
-                        value.append(result2)
-                    else:
-                        value.append(["|", item1[i], result[2]])
-                return value
-        else:
-            item1 = distribution_or_over_and(result[1])
-            item2 = distribution_or_over_and(result[2])
-            # item[0] == "|", item is a clause
-            # item[0] == "&", item is a sentence
-            if item1[0] == "|" and item2[0] == "|":
-                return item1 + item2[1:]
-            elif item1[0] == "&" and item2[0] == "&":
-                return item1 + item2[1:]
-            elif item1[0] == "&" and item2[0] == "|":
-                value = ["&"]
-                for i in range(1, len(item1)):
-                    if isinstance(item1[i], list):
-                        value.append(item1[i] + item2[1:])
-                    else:
-                        temp = deepcopy(item2)
-                        temp.append(item1[i])
-                        value.append(temp)
-                return value
-
-            elif item1[0] == "|" and item2[0] == "&":
-                value = ["&"]
-                for i in range(1, len(item2)):
-                    if isinstance(item2[i],list):
-                        value.append(item2[i] + item1[1:])
-                    else:
-                        temp = deepcopy(item1)
-                        temp.append(item2[i])
-                        value.append(temp)
-                return value
-
-    if result[0] == "&":
-        if isClause(result[1]) and isClause(result[2]):
-            return result
-
-        elif isClause(result[1]):
-            item2 = distribution_or_over_and(result[2])
-            if item2[0] == "|":
-                return ["&", result[1], item2]
-
-            if item2[0] == "&":
-                value = ["&", result[1]]
-                for i in range(1, len(item2)):
-                    value.append(item2[i])
-                return value
-
-        elif isClause(result[2]):
-            item1 = distribution_or_over_and(result[1])
-            if item1[0] == "|":
-                return ["&", result[2], item1]
-
-            if item1[0] == "&":
-                value = ["&", result[2]]
-                for i in range(1, len(item1)):
-                    value.append(item1[i])
-                return value
-
-        elif not isClause(result[1]) and not isClause(result[2]):
-            item1 = distribution_or_over_and(result[1])
-            item2 = distribution_or_over_and(result[2])
-            if item1[0] == "|" and item2[0] == "|":
-                return ["&", item1, item2]
-
-            elif item1[0] == "&" and item2[0] == "&":
-                value = ["&"]
-                for i in range(1, len(item1)):
-                    value.append(item1[i])
-                for i in range(1, len(item2)):
-                    value.append(item2[i])
-                return value
-
-            elif item1[0] == "&" and item2[0] == "|":
-                value = ["&", item2]
-                for i in range(1, len(item1)):
-                    value.append(item1[i])
-                return value
-
-            elif item1[0] == "|" and item2[0] == "&":
-                value = ["&", item1]
-                for i in range(1, len(item2)):
-                    value.append(item2[i])
-                return value
-
-def hasNumbers(inputString):
-    return any(char.isdigit() for char in inputString)
-# standardize variables of clauses
-# standardize clause
+                    cnf = or_cnf(cnf, other, definitions, threshold)
+            results.append(cnf)
+            continue
+        (node, negated, conjunctive, children) = formula_parts(node, negated)
+        if children is None:
+            results.append([[node.negate() if negated else node]])
+            continue
+        parts = []
+        pending = list(reversed(children))
+        while pending:
+            (child, child_negated) = pending.pop()
+            part = formula_parts(child, child_negated)
+            if part[2] == conjunctive:
+                pending.extend(reversed(part[3]))
+            else:
+                parts.append(part)
+        stack.append((node, negated, len(parts), conjunctive))
+        for part in reversed(parts):
+            stack.append((part[0], part[1], None, None))
+    return results[0] + definitions
+
+# Look through the negations in front of node.
+# return value: (node, negated, conjunctive, children), where children are
+# the (node, negated) parts of a connective, or None for a literal
+def formula_parts(node, negated):
+    while isinstance(node, list) and node[0] == "~":
+        node = node[1]
+        negated = not negated
+    if not isinstance(node, list):
+        return (node, negated, None, None)
+    if node[0] == "=>":
+        return (node, negated, negated, [(node[1], not negated), (node[2], negated)])
+    return (node, negated, (node[0] == "&") != negated, [(child, negated) for child in node[1:]])
+
+# Disjunction of two CNFs.  A single clause is extended in place; otherwise
+# every clause of cnf1 is joined with every clause of cnf2.  When that would
+# give more than threshold clauses, each CNF of several clauses is first
+# replaced by a fresh atom D(its variables), and its definition ~D | cnf is
+# added to definitions (Tseitin).  Since D occurs only positively, the one
+# direction is enough for the KB to keep its consequences.  D is named after
+# a hash of the CNF, so equal parts share one definition predicate across
+# sentences and runs.
+# return value: the CNF of the disjunction
+def or_cnf(cnf1, cnf2, definitions, threshold):
+    if len(cnf1) == 1 and len(cnf2) == 1:
+        cnf1[0].extend(cnf2[0])
+        return cnf1
+    if threshold > 0 and len(cnf1) * len(cnf2) > threshold:
+        cnf1 = define_cnf(cnf1, definitions)
+        cnf2 = define_cnf(cnf2, definitions)
+        return or_cnf(cnf1, cnf2, definitions, threshold)
+    return [clause1 + clause2 for clause1 in cnf1 for clause2 in cnf2]
+
+def define_cnf(cnf, definitions):
+    if len(cnf) == 1:
+        return cnf
+    variables = []
+    for clause in cnf:
+        for p in clause:
+            for arg in p.arguments:
+                if arg.islower() and arg not in variables:
+                    variables.append(arg)
+    name = "$D" + hashlib.sha1(repr(cnf).encode("utf-8")).hexdigest()[:16]
+    atom = Predicate(name, variables)
+    for clause in cnf:
+        definitions.append([atom.negate()] + clause)
+    return [[atom]]
+
+# standardize variables of clauses: the variables whose name without counter
+# was seen before get a fresh name from var_map, one per such name
+# return value: the standardized clause
 def standardize(clause, var_map):
     new_visited_variables = set()
     map = {}
+    new_predicates = []
+    changed = False
     for predicate in clause.predicates:
-        for i in range(len(predicate.arguments)):
-            arg = predicate.arguments[i]
-            if not arg.islower():
+        arguments = list(predicate.arguments)
+        codes = predicate.codes
+        for i in range(len(codes)):
+            code = codes[i]
+            if code >= 0:
                 continue
+            prefix = symbols.base(code)
+            if prefix not in var_map:
+                new_visited_variables.add(prefix)
+                continue
+            if prefix in map:
+                arguments[i] = map[prefix]
+                continue
+            new_var = prefix + str(var_map[prefix])
+            arguments[i] = new_var
+            map[prefix] = new_var
+            var_map[prefix] = var_map[prefix] + 1
+        if tuple(arguments) == predicate.arguments:
+            new_predicates.append(predicate)
+        else:
+            new_predicates.append(Predicate(predicate.name, arguments, predicate.positive))
+            changed = True
 
-            if hasNumbers(arg):
-                match = re.match(r"([a-z]+)([0-9]+)", arg, re.I)
-                if match:
-                    items = match.groups()
-                    # items is tuple
-                    prefix = items[0]
-                    if prefix not in var_map:
-                        new_visited_variables.add(prefix)
-                        continue
-                    elif prefix in var_map and prefix in map:
-                        predicate.arguments[i] = map[prefix]
-                    elif prefix in var_map and prefix not in map:
-
-                        new_var = prefix + str(var_map[prefix])
-                        predicate.arguments[i] = new_var
-                        map[prefix] = new_var
-                        var_map[prefix] = var_map[prefix] + 1
+    for var in new_visited_variables:
+        var_map[var] = 1
+    if not changed:
+        return clause
+    return Clause(new_predicates)
+
+
+class LiteralIndex(object):
+    # Discrimination tree over literals.  The root is keyed by predicate name,
+    # sign and arity, and each level below by one argument position: the
+    # symbol id of the constant at that position, or None for any variable.
+    # Leaves are dicts used as ordered sets of (clause, position) pairs,
+    # position being the index of the literal inside the clause.
+    #
+    # retrieve() walks the tree for a literal and yields the (clause,
+    # position) pairs of the literals of the same name, sign and arity that
+    # are
+    #   "unifiable":       unifiable with it,
+    #   "generalizations": mapped onto it by a substitution of its own
+    #                      variables (candidates for subsuming it),
+    #   "instances":       obtained from it by a substitution (candidates for
+    #                      being subsumed by it).
+    # Only argument positions are compared, so repeated variables may let
+    # through a few clauses that the caller then rejects.
+    def __init__(self):
+        self.root = {}
+
+    def add(self, literal, clause, position):
+        key = (literal.name, literal.positive, len(literal.arguments))
+        node = self.root.setdefault(key, {})
+        for code in literal.codes:
+            node = node.setdefault(None if code < 0 else code, {})
+        node[(clause, position)] = True
+
+    def remove(self, literal, clause, position):
+        key = (literal.name, literal.positive, len(literal.arguments))
+        node = self.root.get(key)
+        for code in literal.codes:
+            if node is None:
+                return
+            node = node.get(None if code < 0 else code)
+        if node is not None:
+            node.pop((clause, position), None)
+
+    def retrieve(self, literal, mode):
+        key = (literal.name, literal.positive, len(literal.arguments))
+        if key not in self.root:
+            return
+        args = literal.codes
+        stack = [(self.root[key], 0)]
+        while stack:
+            (node, k) = stack.pop()
+            if k == len(args):
+                for entry in node:
+                    yield entry
+                continue
+            arg = args[k]
+            if arg < 0:
+                if mode == "generalizations":
+                    if None in node:
+                        stack.append((node[None], k + 1))
+                else:
+                    for child in node.values():
+                        stack.append((child, k + 1))
             else:
-                if arg not in var_map:
-                    new_visited_variables.add(arg)
-                    continue
-                elif arg in var_map and arg in map:
-                    predicate.arguments[i] = map[arg]
-                elif arg in var_map and arg not in map:
+                if arg in node:
+                    stack.append((node[arg], k + 1))
+                if mode != "instances" and None in node:
+                    stack.append((node[None], k + 1))
+
+
+class KnowledgeBase(object):
+    # Index of the literals of a set of clauses.  Occurrences are kept apart
+    # by predicate name, sign and arity, each entry pointing at the clause and
+    # the position of the literal inside it, so the resolver goes straight to
+    # the complementary literals of a literal.  The same occurrences are also
+    # kept in a LiteralIndex, which narrows them down by their constants.
+    # Clause membership is a hash lookup in members, and ground unit clauses
+    # are also kept in facts, by predicate name, sign and arity, as sets of
+    # argument tuples.
+    #
+    # A knowledge base may be layered over a parent: lookups see the parent's
+    # clauses followed by this layer's, while additions only touch this
+    # layer.  The parent is never modified, so any number of layers can share
+    # it and a layer is discarded simply by dropping it.
+    def __init__(self, parent = None):
+        self.parent = parent
+        self.members = {}
+        self.occurrences = {}
+        self.literals = LiteralIndex()
+        self.facts = {}
+        # data derived from the clauses by engines, e.g. a materialized model
+        self.cache = {}
+
+    def overlay(self):
+        return KnowledgeBase(self)
+
+    # the bottom layer, holding the clauses loaded from the input
+    def root(self):
+        kb = self
+        while kb.parent is not None:
+            kb = kb.parent
+        return kb
+
+    def contains(self, clause):
+        kb = self
+        while kb is not None:
+            if kb.layer_contains(clause):
+                return True
+            kb = kb.parent
+        return False
 
-                    new_var = arg + str(var_map[arg])
-                    predicate.arguments[i] = new_var
-                    map[arg] = new_var
-                    var_map[arg] = var_map[arg] + 1
+    # is the ground literal a unit clause of some layer
+    def has_fact(self, literal):
+        kb = self
+        while kb is not None:
+            if kb.layer_has_fact(literal):
+                return True
+            kb = kb.parent
+        return False
 
-    for var in new_visited_variables:
-        var_map[var] = 1
+    # retrieve (clause, position) pairs from every layer, see
+    # LiteralIndex.retrieve
+    def retrieve(self, literal, mode):
+        if self.parent is not None:
+            for entry in self.parent.retrieve(literal, mode):
+                yield entry
+        for entry in self.layer_retrieve(literal, mode):
+            yield entry
+
+    def all_clauses(self):
+        if self.parent is not None:
+            for clause in self.parent.all_clauses():
+                yield clause
+        for clause in self.layer_clauses():
+            yield clause
+
+    # lookups restricted to this layer
+    def layer_clauses(self):
+        return iter(self.members)
+
+    def layer_contains(self, clause):
+        return clause in self.members
+
+    def layer_has_fact(self, literal):
+        key = (literal.name, literal.positive, len(literal.arguments))
+        return key in self.facts and literal.arguments in self.facts[key]
+
+    def layer_retrieve(self, literal, mode):
+        return self.literals.retrieve(literal, mode)
+
+    def layer_occurrences(self, key):
+        return self.occurrences.get(key, ())
+
+    # the clauses of this layer with two literals of the same name, sign and
+    # arity, the only ones that can have factors
+    def layer_factorable(self):
+        found = set()
+        for entries in self.occurrences.values():
+            seen = set()
+            for (clause, position) in entries:
+                if clause in seen and clause not in found:
+                    found.add(clause)
+                    yield clause
+                seen.add(clause)
+
+    # (clause, position) pairs of the literals that may resolve with literal
+    def complementary(self, literal):
+        for code in literal.codes:
+            if code > 0:
+                for entry in self.retrieve(literal.negate(), "unifiable"):
+                    yield entry
+                return
+        # no constant to filter on: every occurrence of opposite sign
+        key = (literal.name, not literal.positive, len(literal.arguments))
+        kb = self
+        layers = []
+        while kb is not None:
+            layers.append(kb)
+            kb = kb.parent
+        for kb in reversed(layers):
+            for entry in kb.layer_occurrences(key):
+                yield entry
+
+    def add(self, clause):
+        if self.contains(clause):
+            return False
+        self.members[clause] = True
+        for position in range(len(clause.predicates)):
+            predicate = clause.predicates[position]
+            key = (predicate.name, predicate.positive, len(predicate.arguments))
+            if key in self.occurrences:
+                self.occurrences[key][(clause, position)] = True
+            else:
+                self.occurrences[key] = {(clause, position): True}
+            self.literals.add(predicate, clause, position)
+        if len(clause.predicates) == 1 and isGround(clause.predicates[0]):
+            predicate = clause.predicates[0]
+            key = (predicate.name, predicate.positive, len(predicate.arguments))
+            self.facts.setdefault(key, set()).add(predicate.arguments)
+        return True
+
+    # remove a clause added to this layer; the parent is left untouched
+    def remove(self, clause):
+        if self.members.pop(clause, None) is None:
+            return
+        for position in range(len(clause.predicates)):
+            predicate = clause.predicates[position]
+            key = (predicate.name, predicate.positive, len(predicate.arguments))
+            self.occurrences[key].pop((clause, position), None)
+            self.literals.remove(predicate, clause, position)
+        if len(clause.predicates) == 1 and isGround(clause.predicates[0]):
+            predicate = clause.predicates[0]
+            key = (predicate.name, predicate.positive, len(predicate.arguments))
+            self.facts[key].discard(predicate.arguments)
 
 
 def addClause2KB(clause, KB):
-    for i in range(0, len(clause.predicates)):
-        predicate = clause.predicates[i]
-        if predicate.name in KB and clause not in KB[predicate.name]:
-            KB[predicate.name].append(clause)
-        elif predicate.name not in KB:
-            KB[predicate.name] = [clause]
-
-def equality_lists(list1, list2):
-    if len(list1) != len(list2):
-        return False
-    for i in range(len(list1)):
-        if list1[i] != list2[i]:
+    return KB.add(clause)
+
+
+# Compiled knowledge base snapshots.
+#
+# A snapshot is a flat binary file: a header, holding the digest of the KB
+# sentences it was compiled from (see kbDigest), followed by the sections
+# below, each aligned to 8 bytes and stored in native byte order.
+#   symbols      predicate names, constants and variables, "\n"-separated
+#   clauses      int64, start of each clause in literals (one extra entry)
+#   literals     int32, per literal: +/-(predicate symbol + 1) by sign,
+#                arity, then the argument symbols
+#   keys         int64, per (predicate symbol, positive, arity): the range
+#                of its occurrences
+#   first        int32, per occurrence: symbol of its first argument, -1 for
+#                a variable or no argument; sorted within each key
+#   occ_clause   int32, per occurrence: clause number
+#   occ_position int32, per occurrence: literal position inside the clause
+#   var_map      int32, (variable symbol, counter) pairs of standardize
+#   members      int32, open-addressing hash table of clause number + 1
+SNAPSHOT_MAGIC = b"FOLKB002"
+SNAPSHOT_SECTIONS = ("symbols", "clauses", "literals", "keys", "first",
+                     "occ_clause", "occ_position", "var_map", "members")
+SNAPSHOT_TYPES = {"clauses": "q", "keys": "q"}
+snapshot_header = struct.Struct("=8sI20s" + "qq" * len(SNAPSHOT_SECTIONS))
+
+# the literal data of a clause as a list of ints, or None when it mentions a
+# symbol missing from symbol_ids
+def encodeClause(clause, symbol_ids):
+    data = []
+    for p in clause.predicates:
+        if p.name not in symbol_ids:
+            return None
+        pred = symbol_ids[p.name] + 1
+        data.append(pred if p.positive else -pred)
+        data.append(len(p.arguments))
+        for arg in p.arguments:
+            if arg not in symbol_ids:
+                return None
+            data.append(symbol_ids[arg])
+    return data
+
+def hashClauseData(data):
+    return zlib.crc32(array('i', data).tobytes())
+
+# digest of the KB section of an input file, its count and sentences
+def kbDigest(count, sentences):
+    digest = hashlib.sha1(("%d\n" % count).encode("utf-8"))
+    for s in sentences:
+        digest.update((s.strip() + "\n").encode("utf-8"))
+    return digest.digest()
+
+# return value: the KB digest in the header of a snapshot file, or None if
+# the file is missing or not a snapshot for this machine
+def snapshotDigest(path):
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(snapshot_header.size)
+    except OSError:
+        return None
+    if len(header) < snapshot_header.size:
+        return None
+    header = snapshot_header.unpack(header)
+    if header[0] != SNAPSHOT_MAGIC or header[1] != 0x01020304:
+        return None
+    return header[2]
+
+# write the clauses of KB (a single layer) and var_map to a snapshot file,
+# with the digest of the KB sentences they were compiled from
+def saveSnapshot(KB, var_map, path, digest = b""):
+    symbol_ids = {}
+    def symbol(s):
+        if s not in symbol_ids:
+            symbol_ids[s] = len(symbol_ids)
+        return symbol_ids[s]
+
+    clauses = array('q', [0])
+    literals = array('i')
+    occurrences = {}
+    hashes = []
+    for clause in KB.members:
+        cid = len(clauses) - 1
+        for position in range(len(clause.predicates)):
+            p = clause.predicates[position]
+            key = (symbol(p.name), p.positive, len(p.arguments))
+            first = -1
+            if p.arguments and not p.arguments[0].islower():
+                first = symbol(p.arguments[0])
+            occurrences.setdefault(key, []).append((first, cid, position))
+            for arg in p.arguments:
+                symbol(arg)
+        data = encodeClause(clause, symbol_ids)
+        literals.extend(data)
+        clauses.append(len(literals))
+        hashes.append(hashClauseData(data))
+
+    keys = array('q')
+    first = array('i')
+    occ_clause = array('i')
+    occ_position = array('i')
+    for key in occurrences:
+        entries = sorted(occurrences[key])
+        keys.extend([key[0], 1 if key[1] else 0, key[2], len(first), len(first) + len(entries)])
+        for entry in entries:
+            first.append(entry[0])
+            occ_clause.append(entry[1])
+            occ_position.append(entry[2])
+
+    var_pairs = array('i')
+    for var in var_map:
+        var_pairs.extend([symbol(var), var_map[var]])
+
+    size = 1
+    while size < 2 * len(hashes) + 1:
+        size = size * 2
+    members = array('i', [0]) * size
+    for cid in range(len(hashes)):
+        slot = hashes[cid] & (size - 1)
+        while members[slot] != 0:
+            slot = (slot + 1) & (size - 1)
+        members[slot] = cid + 1
+
+    symbols = "\n".join(sorted(symbol_ids, key=symbol_ids.get)).encode("utf-8")
+    sections = [symbols, clauses.tobytes(), literals.tobytes(), keys.tobytes(), first.tobytes(),
+                occ_clause.tobytes(), occ_position.tobytes(), var_pairs.tobytes(), members.tobytes()]
+
+    offsets = []
+    offset = snapshot_header.size
+    for data in sections:
+        offset = (offset + 7) // 8 * 8
+        offsets.extend([offset, len(data)])
+        offset = offset + len(data)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(snapshot_header.pack(SNAPSHOT_MAGIC, 0x01020304, digest, *offsets))
+        for i in range(len(sections)):
+            f.write(b"\0" * (offsets[2 * i] - f.tell()))
+            f.write(sections[i])
+    os.replace(tmp_path, path)
+
+
+class MappedKnowledgeBase(KnowledgeBase):
+    # Read-only knowledge base backed by a memory-mapped snapshot file (see
+    # saveSnapshot).  Opening one only decodes the symbol table; clauses are
+    # decoded from the mapped arrays when a lookup returns them, and every
+    # process mapping the same file shares its pages.  Occurrences are
+    # narrowed by their first argument only.
+    def __init__(self, path):
+        KnowledgeBase.__init__(self)
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = snapshot_header.unpack_from(self.mm, 0)
+        if header[0] != SNAPSHOT_MAGIC or header[1] != 0x01020304:
+            raise ValueError("%s is not a knowledge base snapshot for this machine" % path)
+        self.digest = header[2]
+        view = memoryview(self.mm)
+        self.sections = {}
+        for i in range(len(SNAPSHOT_SECTIONS)):
+            name = SNAPSHOT_SECTIONS[i]
+            (offset, length) = header[3 + 2 * i:5 + 2 * i]
+            data = view[offset:offset + length]
+            if name != "symbols":
+                data = data.cast(SNAPSHOT_TYPES.get(name, "i"))
+            self.sections[name] = data
+
+        symbols = bytes(self.sections["symbols"]).decode("utf-8")
+        self.symbols = [sys.intern(s) for s in symbols.split("\n")] if symbols else []
+        self.symbol_ids = dict((self.symbols[i], i) for i in range(len(self.symbols)))
+
+        pairs = self.sections["var_map"]
+        self.var_map = dict((self.symbols[pairs[i]], pairs[i + 1]) for i in range(0, len(pairs), 2))
+
+        keys = self.sections["keys"]
+        self.keys = {}
+        for i in range(0, len(keys), 5):
+            key = (self.symbols[keys[i]], keys[i + 1] == 1, keys[i + 2])
+            self.keys[key] = (keys[i + 3], keys[i + 4])
+        self.decoded = {}
+
+    def __len__(self):
+        return len(self.sections["clauses"]) - 1
+
+    def add(self, clause):
+        raise TypeError("a mapped knowledge base is read-only, add to an overlay")
+
+    def remove(self, clause):
+        raise TypeError("a mapped knowledge base is read-only")
+
+    def clause(self, cid):
+        if cid in self.decoded:
+            return self.decoded[cid]
+        clauses = self.sections["clauses"]
+        literals = self.sections["literals"]
+        symbols = self.symbols
+        predicates = []
+        i = clauses[cid]
+        end = clauses[cid + 1]
+        while i < end:
+            pred = literals[i]
+            arity = literals[i + 1]
+            arguments = tuple([symbols[literals[k]] for k in range(i + 2, i + 2 + arity)])
+            predicates.append(Predicate._make(symbols[abs(pred) - 1], arguments, pred > 0))
+            i = i + 2 + arity
+        clause = Clause(predicates)
+        self.decoded[cid] = clause
+        return clause
+
+    def layer_clauses(self):
+        for cid in range(len(self)):
+            yield self.clause(cid)
+
+    def layer_contains(self, clause):
+        data = encodeClause(clause, self.symbol_ids)
+        if data is None:
             return False
-    return True
+        clauses = self.sections["clauses"]
+        literals = self.sections["literals"]
+        members = self.sections["members"]
+        size = len(members)
+        slot = hashClauseData(data) & (size - 1)
+        while members[slot] != 0:
+            cid = members[slot] - 1
+            if clauses[cid + 1] - clauses[cid] == len(data) and literals[clauses[cid]:clauses[cid + 1]].tolist() == data:
+                return True
+            slot = (slot + 1) & (size - 1)
+        return False
 
+    # the members table already hashes the unit clauses
+    def layer_has_fact(self, literal):
+        return isGround(literal) and self.layer_contains(Clause([literal]))
+
+    def entries(self, start, end):
+        occ_clause = self.sections["occ_clause"]
+        occ_position = self.sections["occ_position"]
+        for i in range(start, end):
+            yield (self.clause(occ_clause[i]), occ_position[i])
+
+    def layer_occurrences(self, key):
+        if key not in self.keys:
+            return ()
+        (start, end) = self.keys[key]
+        return self.entries(start, end)
+
+    # only the clauses found are decoded
+    def layer_factorable(self):
+        occ_clause = self.sections["occ_clause"]
+        found = set()
+        for (start, end) in self.keys.values():
+            seen = set()
+            for cid in occ_clause[start:end].tolist():
+                if cid in seen and cid not in found:
+                    found.add(cid)
+                    yield self.clause(cid)
+                seen.add(cid)
+
+    def layer_retrieve(self, literal, mode):
+        key = (literal.name, literal.positive, len(literal.arguments))
+        if key not in self.keys:
+            return
+        (start, end) = self.keys[key]
+        if len(literal.arguments) == 0:
+            for entry in self.entries(start, end):
+                yield entry
+            return
+        first = self.sections["first"]
+        var_end = bisect.bisect_right(first, -1, start, end)
+        arg = literal.arguments[0]
+        if arg.islower():
+            if mode == "generalizations":
+                end = var_end
+            for entry in self.entries(start, end):
+                yield entry
+            return
+        if mode != "instances":
+            for entry in self.entries(start, var_end):
+                yield entry
+        if arg in self.symbol_ids:
+            fid = self.symbol_ids[arg]
+            lo = bisect.bisect_left(first, fid, var_end, end)
+            hi = bisect.bisect_right(first, fid, lo, end)
+            for entry in self.entries(lo, hi):
+                yield entry
+
+# Unification works on the symbol ids of the arguments, a negative id
+# being a variable; the substitutions are returned by name.
 # return value: (can_unify, substitutions)
 def unify(predicate1, predicate2):
     curr_substitutions = {}
 
-    args1 = predicate1.arguments
-    args2 = predicate2.arguments
-    if equality_lists(args1, args2):
+    args1 = predicate1.codes
+    args2 = predicate2.codes
+    if args1 == args2:
         return (True, {})
     else:
         for i in range(len(args1)):
-            if args1[i] == args2[i]:
+            # follow earlier bindings, so that the substitutions always
+            # agree with every position unified so far
+            arg1 = args1[i]
+            while arg1 in curr_substitutions:
+                arg1 = curr_substitutions[arg1]
+            arg2 = args2[i]
+            while arg2 in curr_substitutions:
+                arg2 = curr_substitutions[arg2]
+
+            if arg1 == arg2:
                 continue
-            elif not args1[i].islower() and not args2[i].islower():
+            elif arg1 < 0:
+                curr_substitutions[arg1] = arg2
+            elif arg2 < 0:
+                curr_substitutions[arg2] = arg1
+            else:
                 return (False, {})
 
-            elif args1[i].islower() and not args2[i].islower():
-                if args1[i] in curr_substitutions and curr_substitutions[args1[i]] != args2[i]:
-                    return (False, {})
-                curr_substitutions[args1[i]] = args2[i]
-
-            elif not args1[i].islower() and args2[i].islower():
-                if args2[i] in curr_substitutions and curr_substitutions[args2[i]] != args1[i]:
-                    return (False, {})
-                curr_substitutions[args2[i]] = args1[i]
-
-            elif args1[i].islower() and args2[i].islower():
-                if args1[i] in curr_substitutions and args2[i] in curr_substitutions:
-                    if curr_substitutions[args1[i]] != curr_substitutions[args2[i]]:
-                        return (False, {})
-                elif args1[i] in curr_substitutions:
-                    curr_substitutions[args2[i]] = curr_substitutions[args1[i]]
-                elif args2[i] in curr_substitutions:
-                    curr_substitutions[args1[i]] = curr_substitutions[args2[i]]
-                else:
-                    curr_substitutions[args1[i]] = args2[i]
-                # if they both are not in curr_substitutions, leave them alone
-        return (True, curr_substitutions)
-
-# return value: add_flag(True or False)
+        # bind every variable to the end of its chain, so the substitutions
+        # can be applied in one pass
+        substitutions = {}
+        for var in curr_substitutions:
+            value = curr_substitutions[var]
+            while value in curr_substitutions:
+                value = curr_substitutions[value]
+            substitutions[symbols.name(var)] = symbols.name(value)
+        return (True, substitutions)
+
+# drop repeated literals
+# return value: the simplified clause, or None if it is a tautology
 def simplify(clause):
     predicates = clause.predicates
-    delete_index = []
+    if len(predicates) < 2:
+        return clause
+    seen = set()
+    kept = []
+    for p in predicates:
+        if p in seen:
+            continue
+        if p.negate() in seen:
+            return None
+        seen.add(p)
+        kept.append(p)
+    if len(kept) == len(predicates):
+        return clause
+    return Clause(kept)
+
+
+# resolve clause1 and clause2 on their literals at positions i and j
+# return value: the resolvent, or None
+def resolve_on(clause1, i, clause2, j, var_map):
+    pre1 = clause1.predicates[i]
+    pre2 = clause2.predicates[j]
+    if (pre1.name != pre2.name) or (pre1.positive != (not pre2.positive)):
+        return None
+    (can_unify, substitutions) = unify(pre1, pre2)
+    if not can_unify:
+        return None
+
+    # the resolvent shares every literal the substitution leaves untouched,
+    # so nothing is copied
+    new_predicates = (clause1.predicates[:i] + clause1.predicates[i + 1:] +
+                      clause2.predicates[:j] + clause2.predicates[j + 1:])
+    if substitutions:
+        new_predicates = [p.substitute(substitutions) for p in new_predicates]
+
+    # processing new generated clause
+    new_clause = standardize(Clause(new_predicates), var_map)
+    return simplify(new_clause)
+
+# Factoring: for every two literals of clause with the same sign that
+# unify, the clause with their unifier applied, which merges them.  As
+# simplify() only drops identical literals, binary resolution needs the
+# factors to stay complete, e.g. to refute P(x) | P(y) with ~P(x) | ~P(y).
+# return value: list of the factors up to variants, standardized apart from
+# clause
+def factors(clause, var_map):
+    predicates = clause.predicates
+    result = []
+    keys = set()
     for i in range(len(predicates) - 1):
         for j in range(i + 1, len(predicates)):
-            if predicates[i].name == predicates[j].name:
-                args1 = predicates[i].arguments
-                args2 = predicates[j].arguments
-                if len(args1) != len(args2):
-                    continue
-                if predicates[i].positive == (not predicates[j].positive):
-                    (unify_flag, substitutions) = unify(predicates[i], predicates[j])
-
-                    if unify_flag:
-                        all_lowercase_values = True
-                        for (k, v) in substitutions.items():
-                            if not v.islower():
-                                all_lowercase_values = False
-                        if all_lowercase_values:
-                            return False
-                else:
-                    if equality_lists(args1, args2):
-                        delete_index.append(i)
-                        continue
-                    (unify_flag, substitutions) = unify(predicates[i], predicates[j])
-                    if unify_flag:
-                        all_lowercase_values = True
-                        for (k,v) in substitutions.items():
-                            if not v.islower():
-                                all_lowercase_values = False
-                        if all_lowercase_values:
-                            delete_index.append(i)
-
-    delete_index.sort(reverse = True)
-    for index in delete_index:
-        del predicates[index]
-    return True
+            pre1 = predicates[i]
+            pre2 = predicates[j]
+            if pre1.name != pre2.name or pre1.positive != pre2.positive or len(pre1.codes) != len(pre2.codes):
+                continue
+            (can_unify, substitutions) = unify(pre1, pre2)
+            if not can_unify:
+                continue
+            factor = simplify(Clause([p.substitute(substitutions) for p in predicates]))
+            if factor is None:
+                continue
+            key = canonicalKey(factor)
+            if key not in keys:
+                keys.add(key)
+                result.append(factor)
+    return [standardize(factor, var_map) for factor in result]
+
+
+# number of predicate and argument symbols in clause
+def clause_weight(clause):
+    weight = 0
+    for p in clause.predicates:
+        weight = weight + 1 + len(p.arguments)
+    return weight
+
+# priority of a clause under a selection strategy, smaller is picked first
+def selection_key(strategy, clause, depth):
+    if strategy == "weight" or strategy == "age_weight":
+        return clause_weight(clause)
+    if strategy == "unit":
+        return (len(clause.predicates), clause_weight(clause))
+    if strategy == "goal_distance":
+        # steps taken from the negated query plus literals still to resolve
+        return (depth + len(clause.predicates), clause_weight(clause))
+    return 0
+
+
+class ClauseQueue(object):
+    # Clauses waiting to be processed by the prover, picked according to a
+    # selection strategy (see CLAUSE_SELECTION).  Ties, and the "fifo"
+    # strategy, fall back to age.  With "age_weight" a second heap ordered by
+    # age is kept and every ratio-th pick comes from it, so old clauses are
+    # never starved.
+    def __init__(self, strategy = None, ratio = None):
+        if strategy is None:
+            strategy = CLAUSE_SELECTION
+        if strategy not in ("fifo", "weight", "age_weight", "unit", "goal_distance"):
+            raise ValueError("Unknown clause selection strategy: %s" % strategy)
+        self.strategy = strategy
+        self.ratio = ratio if ratio is not None else AGE_WEIGHT_RATIO
+        self.heap = []
+        self.age_heap = []
+        self.picked = set()
+        self.count = 0
+        self.picks = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, clause, depth = 0):
+        self.count = self.count + 1
+        entry = (selection_key(self.strategy, clause, depth), self.count, clause, depth)
+        heapq.heappush(self.heap, entry)
+        if self.strategy == "age_weight":
+            heapq.heappush(self.age_heap, (self.count, entry))
+        self.size = self.size + 1
+
+    # return value: (clause, depth)
+    def pop(self):
+        self.picks = self.picks + 1
+        if self.strategy == "age_weight" and self.picks % self.ratio == 0:
+            heap = self.age_heap
+        else:
+            heap = self.heap
+        while True:
+            entry = heapq.heappop(heap)
+            if heap is self.age_heap:
+                entry = entry[1]
+            if entry[1] not in self.picked:
+                break
+        if self.strategy == "age_weight":
+            self.picked.add(entry[1])
+        self.size = self.size - 1
+        return (entry[2], entry[3])
+
+
+def bfs_resolution(KB_map, query, var_map, selection = None):
+    start = time.time()
+    query = query.negate()
+    added_clause = Clause([query])
+
+    # the query itself is a clause of the KB
+    if KB_map.contains(Clause([query.negate()])):
+        return True
+    addClause2KB(added_clause, KB_map)
+    for factor in kbFactors(KB_map, var_map, start + TIME_LIMIT):
+        addClause2KB(factor, KB_map)
 
+    queue = ClauseQueue(selection)
+    all_resolvent_s = []
+    # canonical keys of the clauses derived so far, to skip their variants
+    seen = set([canonicalKey(added_clause)])
 
-# return value: (can_resolve, list of new-generated clauses)
-def resolve(clause1, clause2, var_map):
+    for (clause, j) in KB_map.complementary(query):
+        if clause == added_clause:
+            continue
+        new_clause = resolve_on(added_clause, 0, clause, j, var_map)
+        if new_clause is None:
+            continue
+        if len(new_clause.predicates) == 0:
+            return True
+        key = canonicalKey(new_clause)
+        if key in seen:
+            continue
+        seen.add(key)
+        queue.push(new_clause, 1)
+        all_resolvent_s.append(new_clause)
 
-    resolvent_s = []
-    for i in range(len(clause1.predicates)):
-        for j in range(len(clause2.predicates)):
+    for item in all_resolvent_s:
+        addClause2KB(item, KB_map)
 
-            pre1 = clause1.predicates[i]
-            pre2 = clause2.predicates[j]
 
-            if (pre1.name == pre2.name) and (pre1.positive == (not pre2.positive)):
-                (can_unify, substitutions) = unify(pre1, pre2)
-                if not can_unify:
+    while queue:
+        now = time.time()
+        if now - start > TIME_LIMIT:
+            return False
+
+        (curr_clause, depth) = queue.pop()
+        all_new_clauses = []
+        for cl in factors(curr_clause, var_map):
+            key = canonicalKey(cl)
+            if key not in seen:
+                seen.add(key)
+                queue.push(cl, depth + 1)
+                all_new_clauses.append(cl)
+
+        for i in range(len(curr_clause.predicates)):
+            for (c, j) in KB_map.complementary(curr_clause.predicates[i]):
+                now = time.time()
+                if now - start > TIME_LIMIT:
+                    return False
+
+                if c == curr_clause:
                     continue
+                cl = resolve_on(curr_clause, i, c, j, var_map)
+                if cl is None:
+                    continue
+                if len(cl.predicates) == 0:
+                    return True
+                key = canonicalKey(cl)
+                if key in seen:
+                    continue
+                seen.add(key)
+                queue.push(cl, depth + 1)
+                all_new_clauses.append(cl)
+        # add new clauses to KB
+        for claus in all_new_clauses:
+            now = time.time()
+            if now - start > TIME_LIMIT:
+                return False
+            addClause2KB(claus, KB_map)
+    return False
 
-                new_predicates1 = deepcopy(clause1.predicates)
-                new_predicates2 = deepcopy(clause2.predicates)
-
-                del new_predicates1[i]
-                del new_predicates2[j]
-
-                for p in new_predicates1:
-                    for index in range(len(p.arguments)):
-                        if p.arguments[index] in substitutions:
-                            p.arguments[index] = substitutions[p.arguments[index]]
-                for p in new_predicates2:
-                    for index in range(len(p.arguments)):
-                        if p.arguments[index] in substitutions:
-                            p.arguments[index] = substitutions[p.arguments[index]]
-
-                new_clause = Clause(new_predicates1 + new_predicates2)
-                # processing new generated clause
-                standardize(new_clause, var_map)
-                keep_flag = simplify(new_clause)
-                if keep_flag:
-                    resolvent_s.append(new_clause)
-
-    if len(resolvent_s) == 0:
-        return (False, resolvent_s)
-    else:
-        return (True, resolvent_s)
 
+# Variables of args renumbered by first occurrence, so variants of a call
+# share one key.
+def canonicalArguments(args):
+    names = {}
+    key = []
+    for arg in args:
+        if arg.islower():
+            if arg not in names:
+                names[arg] = len(names)
+            key.append(names[arg])
+        else:
+            key.append(arg)
+    return tuple(key)
+
+def literalShape(predicate):
+    return (predicate.name, predicate.positive,
+            tuple([0 if code < 0 else code for code in predicate.codes]))
+
+# arguments of predicate with the variables numbered as in names, and the
+# variables not in names numbered after them by first occurrence
+def renumberedArguments(predicate, names):
+    fresh = {}
+    args = []
+    for code in predicate.codes:
+        if code < 0:
+            if code in names:
+                code = names[code]
+            else:
+                if code not in fresh:
+                    fresh[code] = -len(names) - len(fresh) - 1
+                code = fresh[code]
+        args.append(code)
+    return tuple(args)
+
+# Order of predicates, sorted by shape, that breaks the ties among literals
+# of the same shape: first by the places where each of their variables
+# occurs in the clause, which do not depend on the names of the variables,
+# then by their arguments under the numbering of the literals before them.
+# Literals that still tie keep their order.
+def literalOrder(predicates):
+    shapes = [literalShape(p) for p in predicates]
+    occurrences = {}
+    for i in range(len(predicates)):
+        codes = predicates[i].codes
+        for pos in range(len(codes)):
+            if codes[pos] < 0:
+                occurrences.setdefault(codes[pos], []).append((shapes[i], pos))
+    places = dict([(code, tuple(sorted(occurrences[code]))) for code in occurrences])
+    keyed = sorted([((shapes[i], tuple([places[code] for code in predicates[i].codes if code < 0])), i)
+                    for i in range(len(predicates))])
+    names = {}
+    ordered = []
+    for (order, entries) in itertools.groupby(keyed, lambda entry: entry[0]):
+        group = [predicates[entry[1]] for entry in entries]
+        while group:
+            best = 0
+            if len(group) > 1:
+                best_args = renumberedArguments(group[0], names)
+                for i in range(1, len(group)):
+                    args = renumberedArguments(group[i], names)
+                    if args < best_args:
+                        (best, best_args) = (i, args)
+            p = group.pop(best)
+            for code in p.codes:
+                if code < 0 and code not in names:
+                    names[code] = -len(names) - 1
+            ordered.append(p)
+    return ordered
+
+# Hashable key of a clause, equal for clauses that only differ in the names
+# of their variables and the order of their literals: literals sorted by
+# shape (see literalOrder for ties), then variables numbered by first
+# occurrence (as negative numbers, apart from the symbol ids of the
+# constants).  Only a few variants with symmetric literals of the same
+# shape still get different keys.
+def canonicalKey(clause):
+    predicates = sorted(clause.predicates, key = literalShape)
+    for i in range(len(predicates) - 1):
+        (p, q) = (predicates[i], predicates[i + 1])
+        if p.name == q.name and p.positive == q.positive and literalShape(p) == literalShape(q):
+            predicates = literalOrder(predicates)
+            break
+    names = {}
+    key = []
+    for p in predicates:
+        args = []
+        for code in p.codes:
+            if code < 0:
+                if code not in names:
+                    names[code] = -len(names) - 1
+                code = names[code]
+            args.append(code)
+        key.append((p.name, p.positive, tuple(args)))
+    return tuple(key)
+
+def isTautology(clause):
+    predicates = set(clause.predicates)
+    for p in clause.predicates:
+        if p.positive and p.negate() in predicates:
+            return True
+    return False
 
-# list1 and list2 only contains clauses
-def belong_to(list1, list2):
-    for clause in list1:
-        if clause not in list2:
-            return False
-    return True
+# one-way unification: extend substitutions so that general becomes specific,
+# binding only the variables of general; substitutions map symbol ids
+# return value: the extended substitutions, or None
+def match(general, specific, substitutions):
+    if general.name != specific.name or general.positive != specific.positive:
+        return None
+    args1 = general.codes
+    args2 = specific.codes
+    if len(args1) != len(args2):
+        return None
+    new_substitutions = substitutions
+    for i in range(len(args1)):
+        if args1[i] < 0:
+            bound = new_substitutions.get(args1[i])
+            if bound is None:
+                if new_substitutions is substitutions:
+                    new_substitutions = dict(substitutions)
+                new_substitutions[args1[i]] = args2[i]
+            elif bound != args2[i]:
+                return None
+        elif args1[i] != args2[i]:
+            return None
+    return new_substitutions
+
+def match_predicates(predicates, k, targets, substitutions):
+    if k == len(predicates):
+        return True
+    for target in targets:
+        new_substitutions = match(predicates[k], target, substitutions)
+        if new_substitutions is not None and match_predicates(predicates, k + 1, targets, new_substitutions):
+            return True
+    return False
 
+# clause1 subsumes clause2 if some substitution maps clause1 into clause2
+def subsumes(clause1, clause2):
+    if len(clause1.predicates) > len(clause2.predicates):
+        return False
+    return match_predicates(clause1.predicates, 0, clause2.predicates, {})
+
+# forward subsumption: is clause subsumed by any clause of KB
+def subsumed(clause, KB):
+    seen = set()
+    for p in clause.predicates:
+        for (c, position) in KB.retrieve(p, "generalizations"):
+            if c in seen:
+                continue
+            seen.add(c)
+            if subsumes(c, clause):
+                return True
+    return False
 
-def resolution(KB_map, query, var_map):
+# backward subsumption: remove the clauses of this KB layer subsumed by clause
+# return value: list of the removed clauses
+def remove_subsumed(clause, KB):
+    removed = []
+    if len(clause.predicates) == 0:
+        return removed
+    for (c, position) in list(KB.literals.retrieve(clause.predicates[0], "instances")):
+        if c != clause and subsumes(clause, c):
+            KB.remove(c)
+            removed.append(c)
+    return removed
+
+
+# (i, c, j) resolution pairs of the given clause with the clauses of KB;
+# the facts of KB complementary to ground literals of the given clause come
+# first, as they shorten it at once
+def given_pairs(given, KB):
+    pairs = []
+    first = set()
+    for i in range(len(given.predicates)):
+        complement = given.predicates[i].negate()
+        if isGround(complement) and KB.has_fact(complement):
+            pair = (i, Clause([complement]), 0)
+            pairs.append(pair)
+            first.add(pair)
+    for i in range(len(given.predicates)):
+        for (c, j) in KB.complementary(given.predicates[i]):
+            if c != given and (not first or (i, c, j) not in first):
+                pairs.append((i, c, j))
+    return pairs
+
+# the factors of the clauses of KB's root (see factors), and the factors of
+# those in turn, up to variants, computed on first use.  Past deadline the
+# factors found so far are kept: fewer factors only cost completeness.
+def kbFactors(KB, var_map, deadline = None):
+    root = KB.root()
+    if "factors" not in root.cache:
+        if deadline is None:
+            deadline = time.time() + TIME_LIMIT
+        result = []
+        keys = set()
+        pending = list(root.layer_factorable())
+        while pending and time.time() <= deadline:
+            for factor in factors(pending.pop(), var_map):
+                key = canonicalKey(factor)
+                if key not in keys:
+                    keys.add(key)
+                    result.append(factor)
+                    pending.append(factor)
+        root.cache["factors"] = result
+    return root.cache["factors"]
+
+# Given-clause saturation with the negated query as set of support.
+# KB_map holds the usable (already processed) clauses, which start with the
+# KB and its factors; sos holds the clauses derived from the query that are
+# still waiting to be given.  Each given clause yields its factors and its
+# resolvents with the usable clauses.  New clauses that are tautologies or
+# subsumed are dropped, and each kept one removes the derived clauses it
+# subsumes.
+#
+# Without set_of_support the KB clauses wait in sos along with the negated
+# query and the whole clause set is saturated.  With max_depth, clauses
+# that many resolution steps away from the input are not resolved further,
+# so FALSE is then no longer definitive.
+def given_clause_resolution(KB_map, query, var_map, selection = None, set_of_support = True, max_depth = None):
     start = time.time()
-    query.positive = (not query.positive)
+    query = query.negate()
     added_clause = Clause([query])
 
-    if query.name not in KB_map:
-        KB_map[query.name] = [added_clause]
-    elif added_clause not in KB_map[query.name]:
-        KB_map[query.name].append(added_clause)
-    else:
+    # the query itself is a clause of the KB
+    if KB_map.contains(Clause([query.negate()])):
         return True
 
-    key = query.name
-    related_clauses = KB_map[key]
-    queue = deque([])
-    all_resolvent_s = []
+    sos = ClauseQueue(selection)
+    sos.push(added_clause)
+    sos_index = KnowledgeBase()
+    sos_index.add(added_clause)
+    # canonical keys of the clauses derived so far, to skip their variants
+    # before the costlier subsumption tests
+    seen = set([canonicalKey(added_clause)])
+    if not set_of_support:
+        for clause in KB_map.all_clauses():
+            sos.push(clause)
+            sos_index.add(clause)
+        KB_map = KnowledgeBase()
+    else:
+        for factor in kbFactors(KB_map, var_map, start + TIME_LIMIT):
+            KB_map.add(factor)
 
-    for clause in related_clauses:
-        if clause == added_clause:
+    while sos:
+        if time.time() - start > TIME_LIMIT:
+            return False
+
+        (given, depth) = sos.pop()
+        if not sos_index.contains(given):
+            # removed by backward subsumption while waiting
+            continue
+        sos_index.remove(given)
+        KB_map.add(given)
+        if max_depth is not None and depth >= max_depth:
             continue
-        (can_resolve, resolvent_s) = resolve(added_clause, clause, var_map)
-        for clause in resolvent_s:
-            if len(clause.predicates) == 0:
+
+        # collected first, as backward subsumption changes KB_map
+        pairs = given_pairs(given, KB_map)
+        new_clauses = itertools.chain(factors(given, var_map),
+                                      (resolve_on(given, i, c, j, var_map) for (i, c, j) in pairs))
+
+        for cl in new_clauses:
+            if time.time() - start > TIME_LIMIT:
+                return False
+            if cl is None:
+                continue
+            if len(cl.predicates) == 0:
                 return True
-            queue.append(clause)
-        all_resolvent_s = all_resolvent_s + resolvent_s
+            key = canonicalKey(cl)
+            if key in seen:
+                continue
+            seen.add(key)
+            if isTautology(cl) or subsumed(cl, KB_map) or subsumed(cl, sos_index):
+                continue
+            remove_subsumed(cl, KB_map)
+            remove_subsumed(cl, sos_index)
+            sos.push(cl, depth + 1)
+            sos_index.add(cl)
+    return False
 
-    for item in all_resolvent_s:
-        for p in item.predicates:
-            if p.name in KB_map and item not in KB_map[p.name]:
-                KB_map[p.name].append(item)
-            elif p.name not in KB_map:
-                KB_map[p.name] = [item]
 
+# which of count workers resolves the pair (i, c, j)
+def pair_shard(i, c, j, count):
+    return hash((c, i, j)) % count
 
-    while queue:
-        now = time.time()
-        if now - start > 30:
-            return False
+# resolvents of the given clause on pairs, without tautologies and clauses
+# subsumed by KB
+# return value: list of resolvents, just the empty clause if it was derived
+def resolve_pairs(given, pairs, KB, var_map):
+    resolvents = []
+    for (i, c, j) in pairs:
+        cl = resolve_on(given, i, c, j, var_map)
+        if cl is None:
+            continue
+        if len(cl.predicates) == 0:
+            return [cl]
+        if isTautology(cl) or subsumed(cl, KB):
+            continue
+        resolvents.append(cl)
+    return resolvents
+
+# Worker of parallel_resolution.  KB_map is a replica of the main process's
+# usable clauses, kept in step by the (add, clause) updates sent along with
+# each given clause; the worker resolves its shard of the given clause's pairs
+# and sends back the resolvents.
+def inference_worker(conn, KB_map, var_map, index, count):
+    while True:
+        message = conn.recv()
+        if message is None:
+            return
+        (updates, given) = message
+        for (add, clause) in updates:
+            if add:
+                KB_map.add(clause)
+            else:
+                KB_map.remove(clause)
+        pairs = [(i, c, j) for (i, c, j) in given_pairs(given, KB_map) if pair_shard(i, c, j, count) == index]
+        conn.send(resolve_pairs(given, pairs, KB_map, var_map))
+
+# Given-clause saturation like given_clause_resolution, with the resolution
+# of each given clause sharded across INFERENCE_WORKERS processes forked for
+# the query.  The main process selects given clauses, resolves its own shard,
+# and keeps the set of support and backward subsumption to itself; workers
+# also drop tautologies and resolvents subsumed by the usable clauses.  All
+# workers are stopped as soon as the query is decided.  Falls back to
+# given_clause_resolution when there is a single CPU, no fork, or when
+# running inside a daemonic query worker.
+def parallel_resolution(KB_map, query, var_map, selection = None):
+    workers = INFERENCE_WORKERS or os.cpu_count() or 1
+    if (workers <= 1 or "fork" not in multiprocessing.get_all_start_methods()
+            or multiprocessing.current_process().daemon):
+        return given_clause_resolution(KB_map, query, var_map, selection)
 
-        curr_clause = queue.popleft()
-        all_new_clauses = []
+    start = time.time()
+    query = query.negate()
+    added_clause = Clause([query])
+
+    # the query itself is a clause of the KB
+    if KB_map.contains(Clause([query.negate()])):
+        return True
+
+    # before forking, so the workers' replicas have them too
+    for factor in kbFactors(KB_map, var_map, start + TIME_LIMIT):
+        KB_map.add(factor)
+
+    context = multiprocessing.get_context("fork")
+    connections = []
+    processes = []
+    try:
+        for index in range(1, workers):
+            (conn, child_conn) = context.Pipe()
+            process = context.Process(target=inference_worker,
+                                      args=(child_conn, KB_map, var_map, index, workers))
+            process.daemon = True
+            process.start()
+            connections.append(conn)
+            processes.append(process)
+
+        # changes to the usable clauses not yet sent to the workers
+        updates = []
+        sos = ClauseQueue(selection)
+        sos.push(added_clause)
+        sos_index = KnowledgeBase()
+        sos_index.add(added_clause)
+        seen = set([canonicalKey(added_clause)])
+
+        while sos:
+            if time.time() - start > TIME_LIMIT:
+                return False
 
-        for pre in curr_clause.predicates:
-            if pre.name not in KB_map:
+            (given, depth) = sos.pop()
+            if not sos_index.contains(given):
                 continue
+            sos_index.remove(given)
+            KB_map.add(given)
+            updates.append((True, given))
+
+            pairs = given_pairs(given, KB_map)
+            if len(pairs) < PARALLEL_MIN_PAIRS:
+                resolvents = resolve_pairs(given, pairs, KB_map, var_map)
             else:
-                for c in KB_map[pre.name]:
-                    now = time.time()
-                    if now - start > 30:
+                for conn in connections:
+                    conn.send((updates, given))
+                updates = []
+                pairs = [(i, c, j) for (i, c, j) in pairs if pair_shard(i, c, j, workers) == 0]
+                resolvents = resolve_pairs(given, pairs, KB_map, var_map)
+                for conn in connections:
+                    if not conn.poll(max(0, TIME_LIMIT - (time.time() - start))):
                         return False
+                    # workers name fresh variables on their own, rename them
+                    for cl in conn.recv():
+                        resolvents.append(standardize(cl, var_map))
+
+            for cl in factors(given, var_map) + resolvents:
+                if len(cl.predicates) == 0:
+                    return True
+                key = canonicalKey(cl)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if subsumed(cl, sos_index):
+                    continue
+                for c in remove_subsumed(cl, KB_map):
+                    updates.append((False, c))
+                remove_subsumed(cl, sos_index)
+                sos.push(cl, depth + 1)
+                sos_index.add(cl)
+        return False
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def portfolio_worker(conn, KB_map, query, var_map, config):
+    start = time.time()
+    result = resolution(KB_map, query, var_map, **config)
+    # FALSE is definitive when the search saturated, cut short neither by
+    # the time limit nor by a depth limit
+    definitive = result or (time.time() - start < TIME_LIMIT and config.get("max_depth") is None)
+    conn.send((result, definitive))
+
+# Race the PORTFOLIO configurations on the query, each in a process forked
+# with its own copy of KB_map, and return the first definitive answer; the
+# other processes are then terminated.  Without fork, or inside a daemonic
+# query worker, only the first configuration is run.
+def portfolio_resolution(KB_map, query, var_map, selection = None):
+    if "fork" not in multiprocessing.get_all_start_methods() or multiprocessing.current_process().daemon:
+        return resolution(KB_map, query, var_map, **PORTFOLIO[0])
+
+    start = time.time()
+    context = multiprocessing.get_context("fork")
+    pending = []
+    processes = []
+    try:
+        for config in PORTFOLIO:
+            (conn, child_conn) = context.Pipe(False)
+            process = context.Process(target=portfolio_worker,
+                                      args=(child_conn, KB_map, query, var_map, config))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            pending.append(conn)
+            processes.append(process)
+
+        while pending:
+            remaining = TIME_LIMIT + QUERY_TIME_GRACE - (time.time() - start)
+            if remaining <= 0:
+                return False
+            for conn in multiprocessing.connection.wait(pending, remaining):
+                pending.remove(conn)
+                try:
+                    (result, definitive) = conn.recv()
+                except EOFError:
+                    continue
+                if definitive:
+                    return result
+        return False
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def isGround(predicate):
+    for code in predicate.codes:
+        if code < 0:
+            return False
+    return True
+
+# Split clauses into Horn rules (head, body): head is the positive literal,
+# or None for a clause without one, and body the atoms of the negative
+# literals.  Every variable of a head must occur in its body, so that
+# forward chaining only derives ground facts.
+# return value: list of rules, or None if the clauses do not qualify
+def hornRules(clauses):
+    rules = []
+    for clause in clauses:
+        head = None
+        body = []
+        for p in clause.predicates:
+            if not p.positive:
+                body.append(p.negate())
+            elif head is None:
+                head = p
+            else:
+                return None
+        if head is not None:
+            body_vars = set()
+            for p in body:
+                body_vars.update(p.arguments)
+            for arg in head.arguments:
+                if arg.islower() and arg not in body_vars:
+                    return None
+        rules.append((head, body))
+    return rules
+
+
+class ReteRule(object):
+    # A Horn rule compiled into the join chain of a Rete network.  A token
+    # is the tuple of values of the variables bound by the first k body atoms
+    # (in order of first occurrence).  For body atom k:
+    #   tests[k]       (position, constant) pairs a fact must match
+    #   same[k]        (position, earlier position) pairs of repeated variables
+    #   joins[k]       (token index, position) pairs of variables bound by
+    #                  earlier atoms, the hash key of the join
+    #   new_vars[k]    positions of the variables first bound by this atom
+    # alpha[k] holds the facts matching atom k by join key, beta[k] the tokens
+    # of atoms 0..k by the join key of atom k + 1.
+    def __init__(self, head, body):
+        self.head = head
+        self.body = body
+        self.tests = []
+        self.same = []
+        self.joins = []
+        self.new_vars = []
+        var_index = {}
+        for atom in body:
+            tests = []
+            same = []
+            joins = []
+            new_vars = []
+            first = {}
+            for pos in range(len(atom.arguments)):
+                arg = atom.arguments[pos]
+                if not arg.islower():
+                    tests.append((pos, arg))
+                elif arg in first:
+                    same.append((pos, first[arg]))
+                elif arg in var_index:
+                    first[arg] = pos
+                    joins.append((var_index[arg], pos))
+                else:
+                    first[arg] = pos
+                    var_index[arg] = len(var_index)
+                    new_vars.append(pos)
+            self.tests.append(tests)
+            self.same.append(same)
+            self.joins.append(joins)
+            self.new_vars.append(new_vars)
+        if head is not None:
+            self.head_args = [(arg.islower(), var_index.get(arg, arg)) for arg in head.arguments]
+        self.alpha = [{} for atom in body]
+        self.beta = [{} for atom in body]
+
+    def matches(self, k, fact):
+        args = fact.arguments
+        for (pos, value) in self.tests[k]:
+            if args[pos] != value:
+                return False
+        for (pos, other) in self.same[k]:
+            if args[pos] != args[other]:
+                return False
+        return True
 
-                    if c == curr_clause:
+    def instantiate(self, token):
+        arguments = tuple([token[value] if is_var else value for (is_var, value) in self.head_args])
+        return Predicate._make(self.head.name, arguments, True)
+
+
+class ReteNetwork(object):
+    # Forward-chaining Rete network over range-restricted Horn rules.  Facts
+    # added to the network are matched against the alpha memories of the
+    # body atoms and joined, through hashed beta memories, with the partial
+    # matches of the preceding atoms; completed matches assert the rule head
+    # as a new fact, or make the network inconsistent for a rule without one.
+    # Once all facts are added, facts holds the least model, so a ground atom
+    # is entailed exactly when it is in facts.
+    #
+    # While undo is a list, every change is logged so that retract() can
+    # take back the consequences of a hypothetical fact.  complete is False
+    # when the deadline passed before the model was materialized.
+    def __init__(self, rules, deadline = None):
+        self.rules = []
+        self.dispatch = {}
+        self.facts = set()
+        self.inconsistent = False
+        self.complete = True
+        self.undo = None
+        for (head, body) in rules:
+            if len(body) == 0:
+                continue
+            rule = ReteRule(head, body)
+            self.rules.append(rule)
+            for k in range(len(body)):
+                key = (body[k].name, len(body[k].arguments))
+                self.dispatch.setdefault(key, []).append((rule, k))
+        for (head, body) in rules:
+            if len(body) == 0 and head is None:
+                self.set_inconsistent()
+            elif len(body) == 0 and not self.add_fact(head, deadline):
+                self.complete = False
+                return
+
+    def set_inconsistent(self):
+        if not self.inconsistent:
+            self.inconsistent = True
+            if self.undo is not None:
+                self.undo.append((None, None, None))
+
+    def store(self, memory, key, item):
+        if key in memory:
+            memory[key].append(item)
+        else:
+            memory[key] = [item]
+        if self.undo is not None:
+            self.undo.append((memory, key, item))
+
+    # return value: False if the deadline passed before all the consequences
+    # of fact were added
+    def add_fact(self, fact, deadline = None):
+        agenda = deque([fact])
+        while agenda:
+            if deadline is not None and time.time() > deadline:
+                return False
+            fact = agenda.popleft()
+            if fact in self.facts:
+                continue
+            self.facts.add(fact)
+            if self.undo is not None:
+                self.undo.append((self.facts, None, fact))
+            for (rule, k) in self.dispatch.get((fact.name, len(fact.arguments)), ()):
+                if not rule.matches(k, fact):
+                    continue
+                args = fact.arguments
+                key = tuple([args[pos] for (index, pos) in rule.joins[k]])
+                self.store(rule.alpha[k], key, fact)
+                new_values = tuple([args[pos] for pos in rule.new_vars[k]])
+                if k == 0:
+                    self.activate(rule, 0, new_values, agenda)
+                else:
+                    for token in rule.beta[k - 1].get(key, ()):
+                        self.activate(rule, k, token + new_values, agenda)
+        return True
+
+    # token has matched body atoms 0..k of rule
+    def activate(self, rule, k, token, agenda):
+        stack = [(k, token)]
+        while stack:
+            (k, token) = stack.pop()
+            if k == len(rule.body) - 1:
+                if rule.head is None:
+                    self.set_inconsistent()
+                else:
+                    agenda.append(rule.instantiate(token))
+                continue
+            key = tuple([token[index] for (index, pos) in rule.joins[k + 1]])
+            self.store(rule.beta[k], key, token)
+            for fact in rule.alpha[k + 1].get(key, ()):
+                args = fact.arguments
+                stack.append((k + 1, token + tuple([args[pos] for pos in rule.new_vars[k + 1]])))
+
+    # add fact with logging; the consequences stay until retract()
+    # return value: see add_fact
+    def assume(self, fact, deadline = None):
+        self.undo = []
+        return self.add_fact(fact, deadline)
+
+    def retract(self):
+        undo = self.undo
+        self.undo = None
+        while undo:
+            (memory, key, item) = undo.pop()
+            if memory is None:
+                self.inconsistent = False
+            elif memory is self.facts:
+                self.facts.discard(item)
+            else:
+                memory[key].pop()
+
+# the Rete network of the clauses of KB's root, built on first use within
+# TIME_LIMIT or until deadline
+# return value: the network, or None if the clauses are not range-restricted
+# Horn clauses or the deadline passed before the model was materialized
+def reteNetwork(KB, deadline = None):
+    root = KB.root()
+    if "rete" not in root.cache:
+        if deadline is None:
+            deadline = time.time() + TIME_LIMIT
+        rules = hornRules(root.all_clauses())
+        network = ReteNetwork(rules, deadline) if rules is not None else None
+        root.cache["rete"] = network if network is not None and network.complete else None
+    return root.cache["rete"]
+
+# Answer a ground query from the model materialized by the Rete network of
+# the KB.  A positive atom is entailed when it is in the model; a negative
+# one when assuming the atom makes the rules inconsistent within the time
+# limit.  Other queries, and KBs that are not Horn or whose model takes
+# longer than the time limit, go to given_clause_resolution.
+def rete_resolution(KB_map, query, var_map, selection = None):
+    start = time.time()
+    network = reteNetwork(KB_map)
+    if network is None or not isGround(query):
+        return given_clause_resolution(KB_map, query, var_map, selection)
+    if network.inconsistent:
+        return True
+    if query.positive:
+        return query in network.facts
+    network.assume(query.negate(), start + TIME_LIMIT)
+    result = network.inconsistent
+    network.retract()
+    return result
+
+
+class Relation(object):
+    # Columnar store of the ground facts of one predicate: one list of values
+    # per argument position, with rows numbered in insertion order.  Hash
+    # indexes on sets of positions are built on first use and map a key to
+    # the ascending numbers of its rows, so a range of rows (such as the
+    # facts new in the last round) is a bisection away.
+    def __init__(self, arity):
+        self.columns = [[] for i in range(arity)]
+        self.rows = set()
+        self.size = 0
+        self.indexes = {}
+
+    def row(self, rid):
+        return tuple([column[rid] for column in self.columns])
+
+    def add(self, row):
+        if row in self.rows:
+            return False
+        self.rows.add(row)
+        for pos in range(len(row)):
+            self.columns[pos].append(row[pos])
+        for positions in self.indexes:
+            key = tuple([row[pos] for pos in positions])
+            self.indexes[positions].setdefault(key, []).append(self.size)
+        self.size = self.size + 1
+        return True
+
+    # numbers of the rows in [lo, hi) with the values key at positions, as
+    # a new list: rows added while it is read are not in it
+    def lookup(self, positions, key, lo, hi):
+        if positions not in self.indexes:
+            index = {}
+            for rid in range(self.size):
+                index.setdefault(tuple([self.columns[pos][rid] for pos in positions]), []).append(rid)
+            self.indexes[positions] = index
+        rids = self.indexes[positions].get(key, ())
+        if lo == 0 and hi >= self.size:
+            return rids[:]
+        return rids[bisect.bisect_left(rids, lo):bisect.bisect_left(rids, hi)]
+
+    # forget the rows numbered size and above
+    def truncate(self, size):
+        for rid in range(size, self.size):
+            self.rows.discard(self.row(rid))
+        for column in self.columns:
+            del column[size:]
+        for index in self.indexes.values():
+            for rids in index.values():
+                while rids and rids[-1] >= size:
+                    rids.pop()
+        self.size = size
+
+
+class DatalogProgram(object):
+    # Bottom-up semi-naive evaluation of range-restricted Horn rules (see
+    # hornRules) over columnar relations keyed by (name, arity).
+    #
+    # Each round only joins rule bodies in which some atom matches a fact
+    # new in the previous round (the delta): for body atom i taken from the
+    # delta, atoms before it read the facts older than the delta and atoms
+    # after it read all facts, so every match is found once.  The delta atom
+    # is joined first and the others are probed through hash indexes on
+    # their bound positions.  Rules without a head make the program
+    # inconsistent when their body matches.  complete is False when the
+    # deadline passed before the fixpoint was reached.
+    def __init__(self, rules, deadline = None):
+        self.relations = {}
+        self.rules = []
+        self.inconsistent = False
+        for (head, body) in rules:
+            if len(body) > 0:
+                self.rules.append((head, body))
+            elif head is None:
+                self.inconsistent = True
+            else:
+                self.relation(head).add(head.arguments)
+        self.complete = self.saturate({}, deadline)
+
+    def relation(self, atom):
+        key = (atom.name, len(atom.arguments))
+        if key not in self.relations:
+            self.relations[key] = Relation(len(atom.arguments))
+        return self.relations[key]
+
+    def holds(self, atom):
+        key = (atom.name, len(atom.arguments))
+        return key in self.relations and atom.arguments in self.relations[key].rows
+
+    # run rounds until no new fact is derived; rows of a relation numbered
+    # from old[key] (0 if missing) on are the first delta
+    # return value: False if the deadline passed first
+    def saturate(self, old, deadline = None):
+        old = dict(old)
+        steps = 0
+        while True:
+            new = dict((key, self.relations[key].size) for key in self.relations)
+            if all(old.get(key, 0) == new[key] for key in new):
+                return True
+            for (head, body) in self.rules:
+                for i in range(len(body)):
+                    key = (body[i].name, len(body[i].arguments))
+                    if key not in new or old.get(key, 0) == new[key]:
                         continue
-                    (resolve_flag, new_clauses) = resolve(curr_clause, c, var_map)
-                    for cl in new_clauses:
-                        if len(cl.predicates) == 0:
-                            return True
-                        queue.append(cl)
-                    all_new_clauses = all_new_clauses + new_clauses
-        # add new clauses to KB
-        for claus in all_new_clauses:
-            now = time.time()
-            if now - start > 30:
+                    ranges = []
+                    for j in range(len(body)):
+                        key_j = (body[j].name, len(body[j].arguments))
+                        if j < i:
+                            ranges.append((0, old.get(key_j, 0)))
+                        elif j == i:
+                            ranges.append((old.get(key_j, 0), new[key_j]))
+                        else:
+                            ranges.append((0, new.get(key_j, 0)))
+                    order = [i] + [j for j in range(len(body)) if j != i]
+                    for binding in self.join(body, order, ranges, 0, {}):
+                        steps = steps + 1
+                        if deadline is not None and steps % 256 == 0 and time.time() > deadline:
+                            return False
+                        if head is None:
+                            self.inconsistent = True
+                            break
+                        row = tuple([binding.get(arg, arg) for arg in head.arguments])
+                        self.relation(head).add(row)
+            old = new
+
+    # bindings of the variables of body matching the rows in ranges
+    def join(self, body, order, ranges, k, binding):
+        if k == len(order):
+            yield binding
+            return
+        atom = body[order[k]]
+        key = (atom.name, len(atom.arguments))
+        if key not in self.relations:
+            return
+        relation = self.relations[key]
+        (lo, hi) = ranges[order[k]]
+        positions = []
+        values = []
+        free = []
+        codes = atom.codes
+        for pos in range(len(codes)):
+            arg = atom.arguments[pos]
+            if codes[pos] > 0:
+                positions.append(pos)
+                values.append(arg)
+            elif arg in binding:
+                positions.append(pos)
+                values.append(binding[arg])
+            else:
+                free.append((pos, arg))
+        for rid in relation.lookup(tuple(positions), tuple(values), lo, hi):
+            new_binding = binding
+            if free:
+                new_binding = dict(binding)
+                consistent = True
+                for (pos, arg) in free:
+                    value = relation.columns[pos][rid]
+                    if arg in new_binding and new_binding[arg] != value:
+                        consistent = False
+                        break
+                    new_binding[arg] = value
+                if not consistent:
+                    continue
+            for result in self.join(body, order, ranges, k + 1, new_binding):
+                yield result
+
+    # would adding the ground atom make the program inconsistent, as far as
+    # can be told by the deadline
+    def refutes(self, atom, deadline = None):
+        if self.inconsistent or self.holds(atom):
+            return self.inconsistent
+        old = dict((key, self.relations[key].size) for key in self.relations)
+        self.relation(atom).add(atom.arguments)
+        self.saturate(old, deadline)
+        result = self.inconsistent
+        for key in self.relations:
+            self.relations[key].truncate(old.get(key, 0))
+        self.inconsistent = False
+        return result
+
+# the Datalog program of the clauses of KB's root, evaluated on first use
+# within TIME_LIMIT or until deadline
+# return value: the program, or None if the clauses are not range-restricted
+# Horn clauses or the deadline passed before the fixpoint was reached
+def datalogProgram(KB, deadline = None):
+    root = KB.root()
+    if "datalog" not in root.cache:
+        if deadline is None:
+            deadline = time.time() + TIME_LIMIT
+        rules = hornRules(root.all_clauses())
+        program = DatalogProgram(rules, deadline) if rules is not None else None
+        root.cache["datalog"] = program if program is not None and program.complete else None
+    return root.cache["datalog"]
+
+# Answer a ground query from the least fixpoint of the KB: a positive atom
+# is a hash probe into its relation, a negative one is entailed when adding
+# the atom makes the program inconsistent within the time limit.  Other
+# queries, and KBs that are not Horn or whose fixpoint takes longer than the
+# time limit, go to given_clause_resolution.
+def datalog_resolution(KB_map, query, var_map, selection = None):
+    start = time.time()
+    program = datalogProgram(KB_map)
+    if program is None or not isGround(query):
+        return given_clause_resolution(KB_map, query, var_map, selection)
+    if program.inconsistent:
+        return True
+    if query.positive:
+        return program.holds(query)
+    return program.refutes(query.negate(), start + TIME_LIMIT)
+
+
+class AnswerTable(object):
+    # The answers (ground argument tuples) found so far for one call pattern
+    # of TabledProgram.  index is the position of the call on the stack while
+    # it is evaluated and link the lowest stack position it depends on; an
+    # incomplete table off the stack is completed with its leader.
+    def __init__(self, goal):
+        self.goal = goal
+        self.answers = []
+        self.answer_set = set()
+        self.complete = False
+        self.index = None
+        self.link = None
+        self.leader = None
+
+
+class TabledProgram(object):
+    # Goal-directed SLD resolution over range-restricted Horn rules (see
+    # hornRules) with tabling: every call to a predicate with rules gets an
+    # answer table shared by all its variants, and a call to a table that is
+    # still being evaluated reads its answers so far instead of recursing,
+    # so left- and right-recursive rules terminate.  Tables that depend on
+    # each other (found as on the stack of Tarjan's algorithm) are evaluated
+    # again by the oldest of them, the leader, until none gains an answer,
+    # and then completed together.  Completed tables are kept and answer
+    # later calls directly.
+    #
+    # call, evaluate, expand and solve are generators run by run(): instead
+    # of calling each other they yield the generator of the nested call, so
+    # chains of calls of any length use no Python stack.  They also yield
+    # None every so many answers, only to let run() check its deadline.
+    def __init__(self, rules):
+        self.facts = {}
+        self.rules = {}
+        self.constraints = []
+        self.tables = {}
+        self.stack = []
+        self.incomplete = []
+        self.added = 0
+        self.reads = 0
+        self.consistent = None
+        for (head, body) in rules:
+            if head is None:
+                self.constraints.append(body)
+            elif len(body) == 0:
+                self.relation(head).add(head.arguments)
+            else:
+                key = (head.name, len(head.arguments))
+                self.rules.setdefault(key, []).append((head, body))
+
+    def relation(self, atom):
+        key = (atom.name, len(atom.arguments))
+        if key not in self.facts:
+            self.facts[key] = Relation(len(atom.arguments))
+        return self.facts[key]
+
+    # return value: the argument tuples of the facts matching goal
+    def lookup(self, goal):
+        key = (goal.name, len(goal.arguments))
+        if key not in self.facts:
+            return []
+        relation = self.facts[key]
+        positions = []
+        values = []
+        for pos in range(len(goal.codes)):
+            if goal.codes[pos] > 0:
+                positions.append(pos)
+                values.append(goal.arguments[pos])
+        rows = [relation.row(rid) for rid in relation.lookup(tuple(positions), tuple(values), 0, relation.size)]
+        return [row for row in rows if match_arguments(goal, row) is not None]
+
+    # Run generator and the generators it yields in turn on an explicit
+    # stack: each yielded generator runs to its end, and the one that
+    # yielded it is resumed with its return value.  Past deadline the run
+    # is given up and the tables it left incomplete are dropped.
+    # return value: the return value of generator, or None past deadline
+    def run(self, generator, deadline = None):
+        stack = [generator]
+        value = None
+        while True:
+            if deadline is not None and time.time() > deadline:
+                self.tables = dict((variant, table) for (variant, table) in self.tables.items()
+                                   if table.complete)
+                self.stack = []
+                self.incomplete = []
+                return None
+            try:
+                nested = stack[-1].send(value)
+            except StopIteration as stop:
+                stack.pop()
+                if not stack:
+                    return stop.value
+                value = stop.value
+                continue
+            if nested is not None:
+                stack.append(nested)
+            value = None
+
+    # return value: the answers to goal, which may still grow unless goal
+    # was called from outside any evaluation
+    def call(self, goal):
+        key = (goal.name, len(goal.arguments))
+        if key not in self.rules:
+            return self.lookup(goal)
+        variant = (goal.name, canonicalArguments(goal.arguments))
+        table = self.tables.get(variant)
+        if table is None:
+            table = AnswerTable(goal)
+            self.tables[variant] = table
+            yield self.evaluate(table)
+        elif not table.complete:
+            owner = table
+            while owner.index is None:
+                owner = owner.leader
+            caller = self.stack[-1]
+            caller.link = min(caller.link, owner.index)
+            self.reads = self.reads + 1
+        return table.answers
+
+    def evaluate(self, table):
+        table.index = len(self.stack)
+        table.link = table.index
+        self.stack.append(table)
+        start = len(self.incomplete)
+        self.incomplete.append(table)
+        reads = self.reads
+        yield self.expand(table)
+        if table.link == table.index and self.reads != reads:
+            # some answers were read before they were complete
+            while True:
+                added = self.added
+                i = start
+                while i < len(self.incomplete):
+                    yield self.expand(self.incomplete[i])
+                    i = i + 1
+                if self.added == added or table.link < table.index:
+                    break
+        self.stack.pop()
+        table.index = None
+        if table.link == len(self.stack):
+            for done in self.incomplete[start:]:
+                done.complete = True
+            del self.incomplete[start:]
+        else:
+            table.leader = self.stack[table.link]
+            self.stack[-1].link = min(self.stack[-1].link, table.link)
+
+    # one pass over the facts and rules for the goal of table
+    def expand(self, table):
+        for answer in self.lookup(table.goal):
+            self.add_answer(table, answer)
+        for (head, body) in self.rules[(table.goal.name, len(table.goal.arguments))]:
+            subs = match_arguments(head, table.goal.arguments, table.goal.codes)
+            if subs is None:
+                continue
+            bindings = yield self.solve(body, subs)
+            for i in range(len(bindings)):
+                binding = bindings[i]
+                answer = tuple([binding.get(arg, arg) for arg in head.arguments])
+                if match_arguments(table.goal, answer) is not None:
+                    self.add_answer(table, answer)
+                if i % 1024 == 1023:
+                    yield
+
+    def add_answer(self, table, answer):
+        if answer not in table.answer_set:
+            table.answer_set.add(answer)
+            table.answers.append(answer)
+            self.added = self.added + 1
+
+    # Bindings of the variables of body extending subs.  The body atoms are
+    # called left to right for all bindings so far at once.
+    def solve(self, body, subs):
+        bindings = [subs]
+        for atom in body:
+            extended = []
+            for binding in bindings:
+                goal = atom.substitute(binding) if binding else atom
+                answers = yield self.call(goal)
+                for answer in answers:
+                    new_binding = dict(binding)
+                    for pos in range(len(answer)):
+                        if goal.codes[pos] < 0:
+                            new_binding[goal.arguments[pos]] = answer[pos]
+                    extended.append(new_binding)
+                    if len(extended) % 1024 == 0:
+                        yield
+            bindings = extended
+        return bindings
+
+    # inconsistent, holds and refutes return None past deadline
+    def inconsistent(self, deadline = None):
+        for body in self.constraints:
+            bindings = self.run(self.solve(body, {}), deadline)
+            if bindings is None:
+                return None
+            if len(bindings) > 0:
+                return True
+        return False
+
+    def holds(self, atom, deadline = None):
+        if self.consistent is None:
+            inconsistent = self.inconsistent(deadline)
+            if inconsistent is None:
+                return None
+            self.consistent = not inconsistent
+        if not self.consistent:
+            return True
+        answers = self.run(self.call(atom), deadline)
+        if answers is None:
+            return None
+        return len(answers) > 0
+
+    # would adding the ground atom make the rules inconsistent; the tables
+    # of the KB are set aside while the atom is assumed
+    def refutes(self, atom, deadline = None):
+        holds = self.holds(atom, deadline)
+        if holds is None:
+            return None
+        if holds:
+            return not self.consistent
+        relation = self.relation(atom)
+        size = relation.size
+        relation.add(atom.arguments)
+        tables = self.tables
+        self.tables = {}
+        try:
+            return self.inconsistent(deadline)
+        finally:
+            self.tables = tables
+            self.stack = []
+            self.incomplete = []
+            relation.truncate(size)
+
+# Match the arguments of predicate pattern against values, binding the
+# variables of pattern only; with open_codes, the symbol ids of values,
+# variables among values match anything.
+# return value: the substitutions, or None
+def match_arguments(pattern, values, open_codes = None):
+    subs = {}
+    arguments = pattern.arguments
+    codes = pattern.codes
+    for i in range(len(codes)):
+        value = values[i]
+        if open_codes is not None and open_codes[i] < 0:
+            continue
+        if codes[i] < 0:
+            if subs.setdefault(arguments[i], value) != value:
+                return None
+        elif arguments[i] != value:
+            return None
+    return subs
+
+# the tabled program of the clauses of KB's root, kept with its answer
+# tables across the queries of a run
+# return value: the program, or None if the clauses are not range-restricted
+# Horn clauses
+def tabledProgram(KB):
+    root = KB.root()
+    if "tabling" not in root.cache:
+        rules = hornRules(root.all_clauses())
+        root.cache["tabling"] = TabledProgram(rules) if rules is not None else None
+    return root.cache["tabling"]
+
+# Answer a ground query by tabled SLD resolution: a positive atom is
+# entailed when its call has an answer, a negative one when assuming the
+# atom lets a rule without a head succeed.  Other queries and KBs go to
+# given_clause_resolution.  FALSE past TIME_LIMIT.
+def tabling_resolution(KB_map, query, var_map, selection = None):
+    start = time.time()
+    program = tabledProgram(KB_map)
+    if program is None or not isGround(query):
+        return given_clause_resolution(KB_map, query, var_map, selection)
+    if query.positive:
+        answer = program.holds(query, start + TIME_LIMIT)
+    else:
+        answer = program.refutes(query.negate(), start + TIME_LIMIT)
+    return answer is True
+
+
+class GroundProgram(object):
+    # Grounding of the clauses of a KB together with a few extra clauses
+    # (the negated query).  The grammar has no function symbols, so the
+    # Herbrand universe is just the constants of the clauses, and a clause
+    # set is unsatisfiable exactly when its finitely many ground instances
+    # are.  Two restrictions keep the grounding small:
+    #
+    # - model is the Datalog program of the clauses read as rules from their
+    #   negative literals to each of their positive ones (variables only in
+    #   the head range over the universe, $U), so its facts are the atoms
+    #   that can be true at all.  Only instances whose negative literals are
+    #   all such atoms are built: the others are satisfied by making every
+    #   other atom false, which leaves the built ones untouched.  Clauses
+    #   without a positive literal are rules without a head, so when none
+    #   matches, the model itself satisfies every clause.
+    # - Only the instances a connection tableau with the extra clauses at
+    #   its root can use are built: a ground literal pulls in the instances
+    #   of the KB clauses with a literal matching its complement, and the
+    #   other literals of those are followed in turn.  The literal an
+    #   instance was pulled in by is only followed once the instance is
+    #   pulled in by another one, so a fact met on the way does not pull in
+    #   every rule it matches.  Like set of support, this relies on the KB
+    #   itself being consistent.
+    #
+    # Ground atoms are numbered from 1 and a ground literal is the number of
+    # its atom, negated for a negative literal, as in SatSolver.  The
+    # instances pulled in by each literal are kept, so a program without
+    # extra clauses serves every query it covers (see covers()).  complete
+    # is False when the deadline passed before the model was built.
+    def __init__(self, KB, extra = (), deadline = None):
+        self.KB = KB
+        self.universe = set()
+        rules = []
+        for clause in itertools.chain(KB.all_clauses(), extra):
+            body = [p.negate() for p in clause.predicates if not p.positive]
+            body_vars = set()
+            for p in clause.predicates:
+                for arg in p.arguments:
+                    if not arg.islower():
+                        self.universe.add(arg)
+                    elif not p.positive:
+                        body_vars.add(arg)
+            if len(body) == len(clause.predicates):
+                rules.append((None, body))
+            for p in clause.predicates:
+                if p.positive:
+                    head_vars = set([arg for arg in p.arguments if arg.islower()]) - body_vars
+                    rules.append((p, body + [Predicate("$U", [arg]) for arg in sorted(head_vars)]))
+        # a KB without constants still needs one to ground its variables
+        if len(self.universe) == 0:
+            self.universe.add("$C")
+        for arg in self.universe:
+            rules.append((Predicate("$U", [arg]), []))
+        self.model = DatalogProgram(rules, deadline)
+        self.complete = self.model.complete
+        self.atoms = {}
+        self.keys = [None]
+        self.instances = {}
+
+    # Can the instances of this program be used with clause as the negated
+    # query: it adds no atom to the model.  Its constants are added to the
+    # universe by extend().
+    def covers(self, clause):
+        for p in clause.predicates:
+            if p.positive:
                 return False
-            for p in claus.predicates:
-                if p.name in KB_map and claus not in KB_map[p.name]:
-                    KB_map[p.name].append(claus)
-                elif p.name not in KB_map:
-                    KB_map[p.name] = [claus]
-    return False
+        return True
+
+    # add the constants of clause missing from the universe, for good; the
+    # instances kept so far lack them and are dropped
+    # return value: False if the deadline passed before the model was extended
+    def extend(self, clause, deadline):
+        constants = set([arg for p in clause.predicates for arg in p.arguments if not arg.islower()])
+        constants = constants - self.universe
+        if not constants:
+            return True
+        model = self.model
+        old = dict((key, model.relations[key].size) for key in model.relations)
+        for arg in constants:
+            model.relation(Predicate("$U", [arg])).add((arg,))
+        self.universe.update(constants)
+        self.instances = {}
+        self.complete = model.saturate(old, deadline)
+        return self.complete
+
+    # return value: the number of the ground atom
+    def atom(self, name, arguments):
+        key = (name, arguments)
+        atom = self.atoms.get(key)
+        if atom is None:
+            atom = len(self.keys)
+            self.atoms[key] = atom
+            self.keys.append(key)
+        return atom
+
+    # ground instances of clause extending the substitutions subs
+    # return value: set of tuples of ground literals
+    def ground(self, clause, subs):
+        body = [p.negate() for p in clause.predicates if not p.positive]
+        # the most bound atoms first, to narrow the join early
+        order = sorted(range(len(body)), key = lambda k: len([arg for arg in body[k].arguments
+                                                              if arg.islower() and arg not in subs]))
+        ranges = [(0, sys.maxsize)] * len(body)
+        variables = []
+        for p in clause.predicates:
+            for arg in p.arguments:
+                if arg.islower() and arg not in variables:
+                    variables.append(arg)
+        instances = set()
+        for binding in self.model.join(body, order, ranges, 0, subs):
+            bindings = [binding]
+            for arg in variables:
+                if arg in binding:
+                    continue
+                new_bindings = []
+                for b in bindings:
+                    for value in self.universe:
+                        new_binding = dict(b)
+                        new_binding[arg] = value
+                        new_bindings.append(new_binding)
+                bindings = new_bindings
+            for b in bindings:
+                literals = []
+                for p in clause.predicates:
+                    atom = self.atom(p.name, tuple([b.get(arg, arg) for arg in p.arguments]))
+                    literal = atom if p.positive else -atom
+                    if -literal in literals:
+                        break
+                    if literal not in literals:
+                        literals.append(literal)
+                else:
+                    instances.add(tuple(literals))
+        return instances
+
+    # instances of the clauses of the KB with a literal matching the
+    # complement of a ground literal
+    def expand(self, literal):
+        instances = self.instances.get(literal)
+        if instances is None:
+            (name, arguments) = self.keys[abs(literal)]
+            complement = Predicate._make(name, arguments, literal < 0)
+            instances = set()
+            for (clause, position) in self.KB.retrieve(complement, "unifiable"):
+                subs = match_arguments(clause.predicates[position], arguments)
+                if subs is not None:
+                    instances.update(self.ground(clause, subs))
+            self.instances[literal] = instances
+        return instances
+
+    # return value: the set of ground instances linked to the clauses, or
+    # None if the deadline passes first
+    def relevant(self, clauses, deadline):
+        # instance -> the literal it was pulled in by and that is not
+        # followed yet, 0 once all of its literals are
+        relevant = {}
+        seen = set()
+        queue = deque()
+        for clause in clauses:
+            for instance in self.ground(clause, {}):
+                relevant[instance] = 0
+                for literal in instance:
+                    if literal not in seen:
+                        seen.add(literal)
+                        queue.append(literal)
+        while queue:
+            if time.time() > deadline:
+                return None
+            entry = -queue.popleft()
+            for instance in self.expand(-entry):
+                held = relevant.get(instance)
+                if held is None:
+                    relevant[instance] = entry
+                    for literal in instance:
+                        if literal != entry and literal not in seen:
+                            seen.add(literal)
+                            queue.append(literal)
+                elif held != 0 and held != entry:
+                    relevant[instance] = 0
+                    if held not in seen:
+                        seen.add(held)
+                        queue.append(held)
+        return set(relevant)
+
+    # are the clauses unsatisfiable together with the KB, as decided by the
+    # solver on their relevant instances by the deadline
+    def refutes(self, clauses, deadline):
+        clauses = self.relevant(clauses, deadline)
+        if clauses is None:
+            return False
+        solver = SatSolver()
+        variables = {}
+        for clause in clauses:
+            lits = []
+            for literal in clause:
+                atom = abs(literal)
+                if atom not in variables:
+                    variables[atom] = solver.variable()
+                lits.append(variables[atom] if literal > 0 else -variables[atom])
+            solver.add_clause(lits)
+        return solver.solve(deadline) is False
+
+    # Would adding the ground atom make the KB inconsistent.  The model is
+    # extended by the atom for the time of the check, and its instances are
+    # kept apart from the shared ones.
+    def refutes_atom(self, atom, deadline):
+        model = self.model
+        old = dict((key, model.relations[key].size) for key in model.relations)
+        inconsistent = model.inconsistent
+        instances = self.instances
+        model.relation(atom).add(atom.arguments)
+        try:
+            if not model.saturate(old, deadline):
+                return False
+            # no rule without a head matches: the model satisfies the KB
+            # and the atom
+            if not model.inconsistent:
+                return False
+            self.instances = {}
+            return self.refutes([Clause([atom])], deadline)
+        finally:
+            self.instances = instances
+            for key in model.relations:
+                model.relations[key].truncate(old.get(key, 0))
+            model.inconsistent = inconsistent
+
+# the i-th term (from 1) of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, ...
+def luby(i):
+    while True:
+        k = 1
+        while (1 << k) - 1 < i:
+            k = k + 1
+        if (1 << k) - 1 == i:
+            return 1 << (k - 1)
+        i = i - (1 << (k - 1)) + 1
+
+class SatSolver(object):
+    # Conflict-driven clause learning over clauses of non-zero ints, -v being
+    # the negation of variable v.  Each clause of two or more literals
+    # watches its first two: watches[lit] lists the clauses watching lit,
+    # visited only when lit becomes false.  A conflict is analysed back to
+    # its first unique implication point, the learned clause is added and
+    # the search jumps back to the level where it propagates.  Variables are
+    # picked by activity (bumped in every conflict and decaying over time)
+    # from a lazy heap, with the sign they last had, and the search restarts
+    # after a Luby sequence of conflicts.
+    def __init__(self):
+        self.count = 0
+        self.value = [0]
+        self.level = [0]
+        self.reason = [None]
+        self.activity = [0.0]
+        self.phase = [-1]
+        self.watches = {}
+        self.trail = []
+        # trail length at the start of each decision level
+        self.limits = []
+        self.head = 0
+        self.heap = []
+        self.increment = 1.0
+        self.unsatisfiable = False
+
+    # return value: a new variable
+    def variable(self):
+        self.count = self.count + 1
+        self.value.append(0)
+        self.level.append(0)
+        self.reason.append(None)
+        self.activity.append(0.0)
+        self.phase.append(-1)
+        heapq.heappush(self.heap, (0.0, self.count))
+        return self.count
+
+    def assign(self, lit, reason):
+        v = abs(lit)
+        self.value[v] = 1 if lit > 0 else -1
+        self.level[v] = len(self.limits)
+        self.reason[v] = reason
+        self.trail.append(lit)
+
+    def watch(self, clause):
+        self.watches.setdefault(clause[0], []).append(clause)
+        self.watches.setdefault(clause[1], []).append(clause)
+
+    # add a clause before solving
+    def add_clause(self, lits):
+        clause = []
+        for lit in lits:
+            value = self.value[abs(lit)] if lit > 0 else -self.value[abs(lit)]
+            if value == 1 or -lit in clause:
+                return
+            if value == 0 and lit not in clause:
+                clause.append(lit)
+        if len(clause) == 0:
+            self.unsatisfiable = True
+        elif len(clause) == 1:
+            self.assign(clause[0], None)
+        else:
+            self.watch(clause)
+
+    # propagate the assignments not yet propagated
+    # return value: a clause with every literal false, or None
+    def propagate(self):
+        value = self.value
+        while self.head < len(self.trail):
+            false_lit = -self.trail[self.head]
+            self.head = self.head + 1
+            watchers = self.watches.get(false_lit)
+            if not watchers:
+                continue
+            kept = []
+            for k in range(len(watchers)):
+                clause = watchers[k]
+                if clause[0] == false_lit:
+                    clause[0] = clause[1]
+                    clause[1] = false_lit
+                first = clause[0]
+                first_value = value[first] if first > 0 else -value[-first]
+                if first_value == 1:
+                    kept.append(clause)
+                    continue
+                for m in range(2, len(clause)):
+                    lit = clause[m]
+                    if (value[lit] if lit > 0 else -value[-lit]) != -1:
+                        clause[1] = lit
+                        clause[m] = false_lit
+                        self.watches.setdefault(lit, []).append(clause)
+                        break
+                else:
+                    kept.append(clause)
+                    if first_value == -1:
+                        kept.extend(watchers[k + 1:])
+                        self.watches[false_lit] = kept
+                        return clause
+                    self.assign(first, clause)
+            self.watches[false_lit] = kept
+        return None
+
+    # return value: (learned clause, level to jump back to), the literal
+    # asserted by the clause first
+    def analyze(self, conflict):
+        level = len(self.limits)
+        learned = [None]
+        seen = set()
+        pending = 0
+        lit = None
+        index = len(self.trail) - 1
+        clause = conflict
+        while True:
+            for q in clause:
+                v = abs(q)
+                if q == lit or v in seen or self.level[v] == 0:
+                    continue
+                seen.add(v)
+                self.bump(v)
+                if self.level[v] == level:
+                    pending = pending + 1
+                else:
+                    learned.append(q)
+            while abs(self.trail[index]) not in seen:
+                index = index - 1
+            lit = self.trail[index]
+            index = index - 1
+            pending = pending - 1
+            if pending == 0:
+                break
+            clause = self.reason[abs(lit)]
+        learned[0] = -lit
+        back = 0
+        for k in range(2, len(learned)):
+            if self.level[abs(learned[k])] > self.level[abs(learned[1])]:
+                (learned[1], learned[k]) = (learned[k], learned[1])
+        if len(learned) > 1:
+            back = self.level[abs(learned[1])]
+        return (learned, back)
+
+    def bump(self, v):
+        self.activity[v] = self.activity[v] + self.increment
+        if self.activity[v] > 1e100:
+            for u in range(1, self.count + 1):
+                self.activity[u] = self.activity[u] * 1e-100
+            self.increment = self.increment * 1e-100
+            self.heap = [(-self.activity[u], u) for u in range(1, self.count + 1) if self.value[u] == 0]
+            heapq.heapify(self.heap)
+
+    # undo the assignments above level
+    def backtrack(self, level):
+        if len(self.limits) <= level:
+            return
+        limit = self.limits[level]
+        for lit in self.trail[limit:]:
+            v = abs(lit)
+            self.phase[v] = 1 if lit > 0 else -1
+            self.value[v] = 0
+            self.reason[v] = None
+            heapq.heappush(self.heap, (-self.activity[v], v))
+        del self.trail[limit:]
+        del self.limits[level:]
+        self.head = len(self.trail)
+
+    # return value: the unassigned variable of highest activity, or None
+    def pick(self):
+        while self.heap:
+            v = heapq.heappop(self.heap)[1]
+            if self.value[v] == 0:
+                return v
+        return None
+
+    # return value: True if the clauses are satisfiable, False if not, None
+    # if the deadline passes first
+    def solve(self, deadline = None):
+        if self.unsatisfiable:
+            return False
+        conflicts = 0
+        restarts = 1
+        next_restart = 100 * luby(restarts)
+        while True:
+            conflict = self.propagate()
+            if conflict is None:
+                v = self.pick()
+                if v is None:
+                    return True
+                self.limits.append(len(self.trail))
+                self.assign(v * self.phase[v], None)
+                continue
+            if len(self.limits) == 0:
+                self.unsatisfiable = True
+                return False
+            (learned, back) = self.analyze(conflict)
+            self.backtrack(back)
+            if len(learned) == 1:
+                self.assign(learned[0], None)
+            else:
+                self.watch(learned)
+                self.assign(learned[0], learned)
+            self.increment = self.increment / 0.95
+            conflicts = conflicts + 1
+            if conflicts % 256 == 0 and deadline is not None and time.time() > deadline:
+                return None
+            if conflicts >= next_restart:
+                self.backtrack(0)
+                restarts = restarts + 1
+                next_restart = conflicts + 100 * luby(restarts)
+
+# the grounding of the clauses of KB's root, kept with its instances across
+# the queries of a run
+# the grounding of the clauses of KB's root, shared by the queries of a run,
+# with its model built within TIME_LIMIT or until deadline
+# return value: the program, or None if the deadline passed first
+def groundProgram(KB, deadline = None):
+    root = KB.root()
+    if "sat" not in root.cache:
+        if deadline is None:
+            deadline = time.time() + TIME_LIMIT
+        program = GroundProgram(root, (), deadline)
+        root.cache["sat"] = program if program.complete else None
+    return root.cache["sat"]
+
+# Decide a query by grounding: the KB entails it exactly when the ground
+# instances linked to its negation are unsatisfiable, which the CDCL solver
+# settles either way.  A ground query is answered FALSE at once when the
+# model shows it is not entailed: a positive one whose atom is not in the
+# model, a negative one whose atom added to the model matches no rule
+# without a head.  The constants of a query are added to the shared
+# grounding; only a non-ground negative query gets a grounding of its own.
+# FALSE is only a guess when the grounding or the solver runs out of time,
+# and the KB goes to given_clause_resolution when its model cannot be
+# built in time.
+def sat_resolution(KB_map, query, var_map, selection = None):
+    deadline = time.time() + TIME_LIMIT
+    program = groundProgram(KB_map)
+    if program is None or not program.complete:
+        return given_clause_resolution(KB_map, query, var_map, selection)
+    negated = Clause([query.negate()])
+    if not program.extend(negated, deadline):
+        return False
+    if not isGround(query):
+        if not program.covers(negated):
+            program = GroundProgram(program.KB, [negated], deadline)
+            if not program.complete:
+                return False
+        return program.refutes([negated], deadline)
+    if not query.positive:
+        return program.refutes_atom(negated.predicates[0], deadline)
+    if not program.model.inconsistent and not program.model.holds(query):
+        return False
+    return program.refutes([negated], deadline)
+
+
+RESOLUTION_ENGINES = {
+    "bfs": bfs_resolution,
+    "given_clause": given_clause_resolution,
+    "parallel": parallel_resolution,
+    "portfolio": portfolio_resolution,
+    "rete": rete_resolution,
+    "datalog": datalog_resolution,
+    "tabling": tabling_resolution,
+    "sat": sat_resolution,
+}
+
+# options are passed on to the engine, e.g. set_of_support and max_depth of
+# given_clause_resolution
+def resolution(KB_map, query, var_map, engine = None, selection = None, **options):
+    if engine is None:
+        engine = RESOLUTION_ENGINE
+    if engine not in RESOLUTION_ENGINES:
+        raise ValueError("Unknown resolution engine: %s" % engine)
+    # a query that is itself a fact of the KB needs no search
+    if isGround(query) and KB_map.has_fact(query):
+        return True
+    return RESOLUTION_ENGINES[engine](KB_map, query, var_map, selection, **options)
+
+# build what the engine derives once per KB, before queries are answered:
+# the factors of the KB clauses, which the resolution engines and the
+# fallbacks of the others start from, and the engine's own structures;
+# materialized models are given up past TIME_LIMIT or deadline
+def prepareResolution(KB_map, var_map, engine = None, deadline = None):
+    if engine is None:
+        engine = RESOLUTION_ENGINE
+    if deadline is None:
+        deadline = time.time() + TIME_LIMIT
+    kbFactors(KB_map, var_map, deadline)
+    if engine == "rete":
+        reteNetwork(KB_map, deadline)
+    elif engine == "datalog":
+        datalogProgram(KB_map, deadline)
+    elif engine == "tabling":
+        tabledProgram(KB_map)
+    elif engine == "sat":
+        groundProgram(KB_map, deadline)
+
+
+# parse a KB sentence and convert it to CNF, with definition predicates for
+# the parts of large disjunctions (see or_cnf)
+# return value: list of clauses, not yet standardized, empty if the sentence
+# does not parse
+def sentence2clauses(s):
+    sentence = parser.parse(s)
+    if sentence is None:
+        return []
+    return [Clause(clause) for clause in sentence2cnf(sentence)]
+
+def addSentence2KB(s, KB, var_map, cache = None):
+    clauses = cache.clauses(s) if cache is not None else sentence2clauses(s)
+    for clause in clauses:
+        addClause2KB(standardize(clause, var_map), KB)
+
+CNF_CACHE_MAGIC = b"FOLCNF01"
+
+class CnfCache(object):
+    # Content-addressed store of sentence2clauses results, kept in a pickle
+    # file between runs.  A sentence is keyed by a hash of its text without
+    # whitespace and of CNF_DEFINITION_THRESHOLD, so an edited sentence
+    # simply misses.  Clauses are stored as tuples of (name, arguments,
+    # positive) triples, plain data that does not depend on the module the
+    # classes live in.  save() writes back only the entries used by this
+    # run, which drops those of sentences removed from the KB.  An unreadable
+    # or outdated file is treated as empty.
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.used = {}
+        self.misses = 0
+        try:
+            with open(path, "rb") as f:
+                (magic, entries) = pickle.load(f)
+            if magic == CNF_CACHE_MAGIC:
+                self.entries = entries
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            pass
+
+    def key(self, s):
+        text = "%d\n%s" % (CNF_DEFINITION_THRESHOLD, "".join(s.split()))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    # return value: the clauses of sentence s, not yet standardized
+    def clauses(self, s):
+        key = self.key(s)
+        entry = self.entries.get(key)
+        if entry is None:
+            clauses = sentence2clauses(s)
+            entry = tuple([tuple([(p.name, p.arguments, p.positive) for p in clause.predicates])
+                           for clause in clauses])
+            self.misses = self.misses + 1
+        else:
+            clauses = [Clause([Predicate(name, arguments, positive) for (name, arguments, positive) in clause])
+                       for clause in entry]
+        self.used[key] = entry
+        return clauses
+
+    def save(self):
+        if self.misses == 0 and len(self.used) == len(self.entries):
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump((CNF_CACHE_MAGIC, self.used), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+# Load KB sentences one at a time from any iterable (e.g. readSentences), so
+# that only the sentence being converted is held besides the KB itself.
+# With a CNF cache file (CNF_CACHE by default), the clauses of sentences
+# seen in earlier runs are taken from it.
+# return value: number of sentences loaded
+def loadKnowledgeBase(sentences, KB, var_map, progress_interval = None, cache_path = None):
+    if progress_interval is None:
+        progress_interval = LOAD_PROGRESS_INTERVAL
+    if cache_path is None:
+        cache_path = CNF_CACHE
+    cache = CnfCache(cache_path) if cache_path is not None else None
+    start = time.time()
+    count = 0
+    for s in sentences:
+        addSentence2KB(s, KB, var_map, cache)
+        count = count + 1
+        if progress_interval and count % progress_interval == 0:
+            sys.stderr.write("loaded %d sentences, %d clauses (%.1fs)\n" % (count, len(KB.members), time.time() - start))
+    if cache is not None:
+        cache.save()
+    return count
+
+
+# Read the KB section of an open input file.  With a snapshot file
+# (KB_SNAPSHOT by default), the KB is memory-mapped from it when it was
+# compiled from the same sentences, which are then only hashed; otherwise
+# they are loaded and the snapshot is compiled again.
+# return value: (KB, var_map)
+def readKnowledgeBase(f, snapshot_path = None):
+    if snapshot_path is None:
+        snapshot_path = KB_SNAPSHOT
+    num_of_kb = int(f.readline().strip())
+    if snapshot_path is not None:
+        position = f.tell()
+        digest = kbDigest(num_of_kb, readSentences(f, num_of_kb))
+        if snapshotDigest(snapshot_path) == digest:
+            KB = MappedKnowledgeBase(snapshot_path)
+            return (KB, dict(KB.var_map))
+        f.seek(position)
+    KB = KnowledgeBase()
+    var_map = {}
+    loadKnowledgeBase(readSentences(f, num_of_kb), KB, var_map)
+    if snapshot_path is not None:
+        saveSnapshot(KB, var_map, snapshot_path, digest)
+    return (KB, var_map)
+
+
+class LemmaCache(object):
+    # Answers of earlier queries keyed by their literal with the variables
+    # renumbered (see canonicalArguments), evicted least recently used first
+    # beyond size entries.
+    def __init__(self, size = None):
+        if size is None:
+            size = LEMMA_CACHE_SIZE
+        self.size = size
+        self.answers = OrderedDict()
+
+    def key(self, literal):
+        return (literal.name, literal.positive, canonicalArguments(literal.arguments))
+
+    # return value: the remembered answer, or None
+    def get(self, literal):
+        key = self.key(literal)
+        if key not in self.answers:
+            return None
+        self.answers.move_to_end(key)
+        return self.answers[key]
+
+    def put(self, literal, answer):
+        if self.size <= 0:
+            return
+        key = self.key(literal)
+        self.answers[key] = answer
+        self.answers.move_to_end(key)
+        while len(self.answers) > self.size:
+            self.answers.popitem(last = False)
+
+
+def answerQuery(q):
+    query = parser.parse(q)
+    answer = lemmas.get(query)
+    if answer is not None:
+        return answer
+    start = time.time()
+    # each query works on its own layer over the shared, read-only KB
+    map = KB_map.overlay()
+    answer = resolution(map, query, var_map)
+    # FALSE is only remembered when the search saturated within the time
+    # limit, not when it gave up
+    if answer or time.time() - start < TIME_LIMIT:
+        lemmas.put(query, answer)
+    return answer
+
+# Answer queries against the loaded KB_map, yielding the answers in order as
+# they become available.  With several workers the queries are fanned out to
+# a pool of forked processes, which inherit KB_map instead of copying it.
+def answerQueries(queries, workers = None):
+    if workers is None:
+        workers = QUERY_WORKERS
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(queries))
+    # shared with the workers rather than built by each of them
+    prepareResolution(KB_map, var_map)
+    if workers <= 1 or "fork" not in multiprocessing.get_all_start_methods():
+        for q in queries:
+            yield answerQuery(q)
+        return
+
+    pool = multiprocessing.get_context("fork").Pool(workers)
+    try:
+        results = [pool.apply_async(answerQuery, (q,)) for q in queries]
+        for result in results:
+            # a query starts at the latest when the previous answer is in,
+            # so this only fires for a worker stuck past its time limit
+            try:
+                yield result.get(TIME_LIMIT + QUERY_TIME_GRACE)
+            except multiprocessing.TimeoutError:
+                yield False
+    finally:
+        pool.terminate()
 
 
 # ------------------  main start  --------------------------
 
 input_path = "./input.txt"
 output_path = "./output.txt"
-(queries, ori_KB) = parseInputFile(input_path)
 
 var_map = {}
-KB_map = {}
-
-for s in ori_KB:
-    result = parser.parse(s)
-
-    result = eliminate_implication(result)
-
-    result = move_not_inward(result)
-
-    result = distribution_or_over_and(result)
-
-    if isinstance(result, Predicate):
-        new_clause = Clause([result])
-        standardize(new_clause, var_map)
-        if result.name in KB_map and new_clause not in KB_map[result.name]:
-            KB_map[result.name].append(new_clause)
-        elif result.name not in KB_map:
-            KB_map[result.name] = [new_clause]
-
-    elif isinstance(result, list):
-        if result[0] == "|":
-            new_clause = Clause(result[1:])
-            standardize(new_clause, var_map)
-            addClause2KB(new_clause, KB_map)
-
-        elif result[0] == "&":
-            for i in range(1, len(result)):
-                if isinstance(result[i], Predicate):
-                    new_clause = Clause([result[i]])
-                    standardize(new_clause, var_map)
-                    if result[i].name in KB_map and new_clause not in KB_map[result[i].name]:
-                        KB_map[result[i].name].append(new_clause)
-                    elif result[i].name not in KB_map:
-                        KB_map[result[i].name] = [new_clause]
-                elif isinstance(result[i], list):
-                    new_clause = Clause(result[i][1:])
-                    standardize(new_clause, var_map)
-                    addClause2KB(new_clause, KB_map)
-
-with open(output_path, 'w') as f:
-
-    for q in queries:
-        query = parser.parse(q)
-        map = deepcopy(KB_map)
-        query_result = resolution(map, query, var_map)
-
-        if query_result:
-            print_result = "TRUE"
-        else:
-            print_result = "FALSE"
-
-        f.write(print_result + '\n')
+KB_map = KnowledgeBase()
+lemmas = LemmaCache()
 
+if __name__ == "__main__":
+    with open(input_path, 'r') as f:
+        num_of_queries = int(f.readline().strip())
+        queries = list(readSentences(f, num_of_queries))
+        (KB_map, var_map) = readKnowledgeBase(f)
 
+    with open(output_path, 'w') as f:
 
+        for query_result in answerQueries(queries):
 
+            if query_result:
+                print_result = "TRUE"
+            else:
+                print_result = "FALSE"
 
+            f.write(print_result + '\n')
+            f.flush()
@@ -0,0 +1,11 @@
+# fol_lextab.py. This file automatically created by PLY (version 3.9). Don't edit!
+_tabversion   = '3.8'
+_lextokens    = set(('NOT', 'LPAREN', 'OR', 'RPAREN', 'IMPLY', 'COMMA', 'FACTOR', 'AND'))
+_lexreflags   = 0
+_lexliterals  = ''
+_lexstateinfo = {'INITIAL': 'inclusive'}
+_lexstatere   = {'INITIAL': [('(?P<t_newline>\\n+)|(?P<t_FACTOR>[A-z]+)|(?P<t_AND>\\&)|(?P<t_IMPLY>=>)|(?P<t_LPAREN>\\()|(?P<t_OR>\\|)|(?P<t_RPAREN>\\))|(?P<t_COMMA>,)|(?P<t_NOT>~)', [None, ('t_newline', 'newline'), (None, 'FACTOR'), (None, 'AND'), (None, 'IMPLY'), (None, 'LPAREN'), (None, 'OR'), (None, 'RPAREN'), (None, 'COMMA'), (None, 'NOT')])]}
+_lexstateignore = {'INITIAL': ' \t'}
+_lexstateerrorf = {'INITIAL': 't_error'}
+_lexstateeoff = {}
+_lexsignature = 'e3e82f8716142d9b091a9a7f1572557f1af362db'
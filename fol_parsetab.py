@@ -0,0 +1,38 @@
+
+# fol_parsetab.py
+# This file is automatically generated. Do not edit.
+_tabversion = '3.8'
+
+_lr_method = 'LALR'
+
+_lr_signature = 'E261B0D057A84CB50E5955890B1F3D25'
+    
+_lr_action_items = {'LPAREN':([0,2,5,6,8,11,12,13,14,],[2,2,9,2,15,19,2,2,2,]),'FACTOR':([0,2,3,6,9,12,13,14,15,19,25,],[5,5,8,11,16,5,5,5,16,16,16,]),'NOT':([0,2,6,12,13,14,],[3,6,3,3,3,3,]),'$end':([1,4,18,24,27,28,29,30,],[0,-5,-1,-6,-2,-3,-4,-7,]),'IMPLY':([4,7,18,24,27,28,29,32,],[-5,12,-1,-6,-2,-3,-4,-7,]),'AND':([4,7,18,24,27,28,29,32,],[-5,13,-1,-6,-2,-3,-4,-7,]),'OR':([4,7,18,24,27,28,29,32,],[-5,14,-1,-6,-2,-3,-4,-7,]),'RPAREN':([4,10,16,17,18,20,21,22,23,24,26,27,28,29,30,31,32,],[-5,18,-9,24,-1,27,28,29,30,-6,32,-2,-3,-4,-7,-8,-6,]),'COMMA':([16,17,23,26,31,],[-9,25,25,25,25,]),}
+
+_lr_action = {}
+for _k, _v in _lr_action_items.items():
+   for _x,_y in zip(_v[0],_v[1]):
+      if not _x in _lr_action:  _lr_action[_x] = {}
+      _lr_action[_x][_k] = _y
+del _lr_action_items
+
+_lr_goto_items = {'expression':([0,2,6,12,13,14,],[1,7,10,20,21,22,]),'predicate':([0,2,6,12,13,14,],[4,4,4,4,4,4,]),'argument':([9,15,19,25,],[17,23,26,31,]),}
+
+_lr_goto = {}
+for _k, _v in _lr_goto_items.items():
+   for _x, _y in zip(_v[0], _v[1]):
+       if not _x in _lr_goto: _lr_goto[_x] = {}
+       _lr_goto[_x][_k] = _y
+del _lr_goto_items
+_lr_productions = [
+  ("S' -> expression","S'",1,None,None,None),
+  ('expression -> LPAREN NOT expression RPAREN','expression',4,'p_not_expression','fol_agent.py',177),
+  ('expression -> LPAREN expression IMPLY expression RPAREN','expression',5,'p_imply','fol_agent.py',184),
+  ('expression -> LPAREN expression AND expression RPAREN','expression',5,'p_expression_predicates_and','fol_agent.py',188),
+  ('expression -> LPAREN expression OR expression RPAREN','expression',5,'p_expression_predicates_or','fol_agent.py',192),
+  ('expression -> predicate','expression',1,'p_expression_predicate','fol_agent.py',196),
+  ('predicate -> FACTOR LPAREN argument RPAREN','predicate',4,'p_predicate_argument','fol_agent.py',200),
+  ('predicate -> NOT FACTOR LPAREN argument RPAREN','predicate',5,'p_not_predicate_argument','fol_agent.py',204),
+  ('argument -> argument COMMA argument','argument',3,'p_arguments_argument','fol_agent.py',208),
+  ('argument -> FACTOR','argument',1,'p_argument_factor','fol_agent.py',213),
+]
@@ -0,0 +1,640 @@
+import itertools
+import pickle
+import random
+import sys
+import types
+
+import pytest
+
+import fol_agent
+from fol_agent import Clause, KnowledgeBase
+
+
+# ------------------  helpers  --------------------------
+
+# bfs only answers FALSE at the time limit, having no subsumption
+@pytest.fixture(autouse=True)
+def time_limit(monkeypatch):
+    monkeypatch.setattr(fol_agent, "TIME_LIMIT", 2)
+
+# load KB sentences as the main program does
+# return value: (KB, var_map)
+def load(sentences):
+    KB = KnowledgeBase()
+    var_map = {}
+    fol_agent.loadKnowledgeBase(sentences, KB, var_map)
+    return (KB, var_map)
+
+def ask(sentences, query, engine, **options):
+    (KB, var_map) = load(sentences)
+    return fol_agent.resolution(KB.overlay(), fol_agent.parser.parse(query), var_map, engine, **options)
+
+# is there an assignment of the ground atoms satisfying every ground
+# instance of clauses; only usable on a handful of ground atoms
+def satisfiable(clauses):
+    universe = set()
+    for clause in clauses:
+        for p in clause.predicates:
+            universe.update([arg for arg in p.arguments if not arg.islower()])
+    universe = sorted(universe) or ["C"]
+    ground = []
+    for clause in clauses:
+        variables = sorted(set([arg for p in clause.predicates for arg in p.arguments if arg.islower()]))
+        for values in itertools.product(universe, repeat=len(variables)):
+            subs = dict(zip(variables, values))
+            ground.append([(p.name, tuple([subs.get(arg, arg) for arg in p.arguments]), p.positive)
+                           for p in clause.predicates])
+    atoms = sorted(set([(name, args) for instance in ground for (name, args, positive) in instance]))
+    for values in itertools.product((False, True), repeat=len(atoms)):
+        model = dict(zip(atoms, values))
+        if all(any(model[(name, args)] == positive for (name, args, positive) in instance)
+               for instance in ground):
+            return True
+    return False
+
+# Truth-table oracle: the KB entails the query exactly when the KB clauses
+# and the negated query are unsatisfiable.
+def entails(sentences, query):
+    (KB, var_map) = load(sentences)
+    negated = Clause([fol_agent.parser.parse(query).negate()])
+    return not satisfiable(list(KB.all_clauses()) + [negated])
+
+def random_literal(rng, arguments, negative):
+    name = rng.choice(["P", "Q", "R"])
+    arity = 2 if name == "R" else 1
+    literal = "%s(%s)" % (name, ",".join([rng.choice(arguments) for i in range(arity)]))
+    return "~" + literal if rng.random() < negative else literal
+
+# a small random KB over the constants A and B, and a ground query; the
+# engines assume the KB itself is consistent, like set of support does
+def random_problem(rng):
+    while True:
+        (sentences, query) = random_sentences(rng)
+        if satisfiable(list(load(sentences)[0].all_clauses())):
+            return (sentences, query)
+
+def random_sentences(rng):
+    sentences = []
+    for i in range(rng.randint(2, 4)):
+        kind = rng.random()
+        if kind < 0.3:
+            sentences.append(random_literal(rng, ["A", "B"], 0.2))
+        elif kind < 0.75:
+            body = [random_literal(rng, ["x", "y", "z", "A"], 0.15) for k in range(rng.randint(1, 2))]
+            if len(body) == 2:
+                body = "(%s & %s)" % tuple(body)
+            else:
+                body = body[0]
+            sentences.append("(%s => %s)" % (body, random_literal(rng, ["x", "y", "A"], 0.15)))
+        else:
+            sentences.append("(%s | %s)" % (random_literal(rng, ["x", "y", "B"], 0.3),
+                                            random_literal(rng, ["x", "y", "A"], 0.3)))
+    return (sentences, random_literal(rng, ["A", "B"], 0.2))
+
+RANDOM_PROBLEMS = [random_problem(random.Random(seed)) for seed in range(200)]
+
+
+# ------------------  CDCL solver  --------------------------
+
+def test_luby():
+    assert [fol_agent.luby(i) for i in range(1, 16)] == [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8]
+
+def brute_force_sat(count, clauses):
+    for values in itertools.product((False, True), repeat=count):
+        if all(any(values[abs(lit) - 1] == (lit > 0) for lit in clause) for clause in clauses):
+            return True
+    return False
+
+@pytest.mark.parametrize("seed", range(200))
+def test_sat_solver_agrees_with_truth_table(seed):
+    rng = random.Random(seed)
+    count = rng.randint(1, 8)
+    clauses = []
+    for i in range(rng.randint(1, 5 * count)):
+        clauses.append([rng.choice((1, -1)) * rng.randint(1, count) for k in range(rng.randint(1, 3))])
+    solver = fol_agent.SatSolver()
+    for i in range(count):
+        solver.variable()
+    for clause in clauses:
+        solver.add_clause(clause)
+    result = solver.solve()
+    assert result == brute_force_sat(count, clauses)
+    if result:
+        # the final assignment is a model
+        for clause in clauses:
+            assert any(solver.value[abs(lit)] == (1 if lit > 0 else -1) for lit in clause)
+
+
+# ------------------  engines against the oracle  --------------------------
+
+# the example of the README (input.txt)
+README_KB = ["Mother(Liz,Charley)", "Father(Charley,Billy)",
+             "((~Mother(x,y)) | Parent(x,y))", "((~Father(x,y)) | Parent(x,y))",
+             "((~Parent(x,y)) | Ancestor(x,y))",
+             "((~(Parent(x,y) & Ancestor(y,z))) | Ancestor(x,z))"]
+
+ENGINES = ["given_clause", "bfs", "parallel", "portfolio", "rete", "datalog", "tabling", "sat"]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_on_readme_example(engine):
+    assert ask(README_KB, "Ancestor(Liz,Billy)", engine) is True
+    assert ask(README_KB, "Ancestor(Liz,Bob)", engine) is False
+
+# proofs that need a factoring step; rete, datalog and tabling fall back to
+# given_clause on the non-Horn KB
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_factors_clauses(engine):
+    assert ask(["(P(x) | P(y))", "((P(x) & P(y)) => Q(A))"], "Q(A)", engine) is True
+    assert ask(["Q(A)", "(Q(A) => R(C,A))", "((R(z,y) & R(x,y)) => P(y))"], "P(A)", engine) is True
+
+# the factors of a wide clause are all variants of a handful of clauses
+def test_kb_factors_are_kept_up_to_variants():
+    wide = "P(a)"
+    for var in "bcdefg":
+        wide = "(%s | P(%s))" % (wide, var)
+    (KB, var_map) = load([wide, "(P(x) => Q(A))", "R(A)"])
+    assert list(KB.layer_factorable()) == list(KB.all_clauses())[:1]
+    fol_agent.prepareResolution(KB, var_map, "given_clause")
+    assert len(KB.cache["factors"]) == 6
+    assert ask([wide, "(P(x) => Q(A))"], "Q(A)", "given_clause") is True
+
+@pytest.mark.parametrize("literals", [["P(x,y)", "P(y,z)", "~Q(x)"],
+                                      ["P(x,y)", "P(z,w)", "Q(x,w)"],
+                                      ["P(x,A)", "P(y,x)", "~R(y,z)", "P(z,x)"]])
+def test_canonical_key_ignores_literal_order(literals):
+    renaming = {"x": "u", "y": "v", "z": "s", "w": "t"}
+    keys = set()
+    for order in itertools.permutations(literals):
+        for names in [{}, renaming]:
+            clause = Clause([fol_agent.parser.parse(literal).substitute(names) for literal in order])
+            keys.add(fol_agent.canonicalKey(clause))
+    assert len(keys) == 1
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("problem", range(len(RANDOM_PROBLEMS)))
+def test_engine_agrees_with_oracle(engine, problem):
+    (sentences, query) = RANDOM_PROBLEMS[problem]
+    assert ask(sentences, query, engine) == entails(sentences, query), (sentences, query)
+
+
+# ------------------  CNF conversion  --------------------------
+
+ATOMS = ["P(A)", "P(B)", "Q(A)", "R(A,B)"]
+
+def random_formula(rng, depth):
+    if depth == 0 or rng.random() < 0.25:
+        atom = rng.choice(ATOMS)
+        return "~" + atom if rng.random() < 0.3 else atom
+    kind = rng.choice(["~", "=>", "&", "|"])
+    if kind == "~":
+        return "(~%s)" % random_formula(rng, depth - 1)
+    return "(%s %s %s)" % (random_formula(rng, depth - 1), kind, random_formula(rng, depth - 1))
+
+# truth value of a parsed sentence, model mapping atoms to booleans
+def evaluate(node, model):
+    if not isinstance(node, list):
+        return model[node.name, node.arguments] == node.positive
+    if node[0] == "~":
+        return not evaluate(node[1], model)
+    if node[0] == "=>":
+        return not evaluate(node[1], model) or evaluate(node[2], model)
+    if node[0] == "&":
+        return evaluate(node[1], model) and evaluate(node[2], model)
+    return evaluate(node[1], model) or evaluate(node[2], model)
+
+def holds(cnf, model):
+    return all(any(model[p.name, p.arguments] == p.positive for p in clause) for clause in cnf)
+
+def models(atoms):
+    for values in itertools.product((False, True), repeat=len(atoms)):
+        yield dict(zip(atoms, values))
+
+@pytest.mark.parametrize("seed", range(300))
+def test_cnf_is_equivalent(seed):
+    sentence = fol_agent.parser.parse(random_formula(random.Random(seed), 4))
+    cnf = fol_agent.sentence2cnf(sentence, 0)
+    atoms = [(p.name, p.arguments) for p in map(fol_agent.parser.parse, ATOMS)]
+    for model in models(atoms):
+        assert holds(cnf, model) == evaluate(sentence, model)
+
+# with definitions the CNF is no longer equivalent, but a model of the
+# sentence extends to exactly the models of the CNF over the same atoms
+@pytest.mark.parametrize("seed", range(300))
+def test_definitional_cnf_is_equisatisfiable(seed):
+    sentence = fol_agent.parser.parse(random_formula(random.Random(seed), 4))
+    cnf = fol_agent.sentence2cnf(sentence, 1)
+    atoms = [(p.name, p.arguments) for p in map(fol_agent.parser.parse, ATOMS)]
+    definitions = sorted(set([(p.name, p.arguments) for clause in cnf for p in clause
+                              if p.name.startswith("$D")]))
+    for model in models(atoms):
+        extended = []
+        for values in itertools.product((False, True), repeat=len(definitions)):
+            extended.append(dict(model))
+            extended[-1].update(zip(definitions, values))
+        assert any(holds(cnf, m) for m in extended) == evaluate(sentence, model)
+
+def test_cnf_of_deep_sentence():
+    sentence = fol_agent.parser.parse("P(A)")
+    for i in range(5000):
+        sentence = ["|", ["~", sentence], fol_agent.parser.parse("Q(A)")]
+    cnf = fol_agent.sentence2cnf(sentence)
+    assert len(cnf) >= 1
+
+def test_malformed_sentences_are_skipped():
+    assert fol_agent.sentence2clauses("(P(x) Q(x))") == []
+    assert fol_agent.sentence2clauses("") == []
+    (KB, var_map) = load(["P(A)", "(P(x) Q(x))", ""])
+    assert list(KB.all_clauses()) == [Clause([fol_agent.parser.parse("P(A)")])]
+
+
+
+# ------------------  CNF cache  --------------------------
+
+def test_cnf_cache_hit_skips_conversion(tmp_path, monkeypatch):
+    path = str(tmp_path / "cnf.pickle")
+    cache = fol_agent.CnfCache(path)
+    clauses = cache.clauses("P(x) => Q(x)")
+    assert cache.misses == 1
+    cache.save()
+    def convert(s):
+        raise AssertionError("converted " + s)
+    monkeypatch.setattr(fol_agent, "sentence2clauses", convert)
+    cache = fol_agent.CnfCache(path)
+    assert cache.clauses("P( x )  =>  Q(x)") == clauses
+    assert cache.misses == 0
+
+def test_cnf_cache_misses_edited_sentence(tmp_path):
+    path = str(tmp_path / "cnf.pickle")
+    cache = fol_agent.CnfCache(path)
+    cache.clauses("P(x) => Q(x)")
+    cache.save()
+    cache = fol_agent.CnfCache(path)
+    assert cache.clauses("P(x) => R(x)") == fol_agent.sentence2clauses("P(x) => R(x)")
+    assert cache.misses == 1
+
+@pytest.mark.parametrize("content", [b"", b"not a pickle",
+                                     pickle.dumps((b"FOLCNF00", {"key": ()})),
+                                     pickle.dumps(42)])
+def test_unreadable_cnf_cache_is_empty(tmp_path, content):
+    path = tmp_path / "cnf.pickle"
+    path.write_bytes(content)
+    cache = fol_agent.CnfCache(str(path))
+    assert cache.entries == {}
+    assert cache.clauses("P(A)") == [Clause([fol_agent.parser.parse("P(A)")])]
+
+def test_cnf_cache_save_drops_unused_entries(tmp_path):
+    path = str(tmp_path / "cnf.pickle")
+    fol_agent.loadKnowledgeBase(["P(A)", "Q(A)", "R(A)"], KnowledgeBase(), {}, cache_path=path)
+    assert len(fol_agent.CnfCache(path).entries) == 3
+    fol_agent.loadKnowledgeBase(["P(A)", "R(A)"], KnowledgeBase(), {}, cache_path=path)
+    cache = fol_agent.CnfCache(path)
+    assert set(cache.entries) == set([cache.key("P(A)"), cache.key("R(A)")])
+
+# ------------------  KB snapshots  --------------------------
+
+def write_kb_section(path, sentences):
+    with open(path, "w") as f:
+        f.write("%d\n%s\n" % (len(sentences), "\n".join(sentences)))
+
+def read_kb_section(path, snapshot):
+    with open(path) as f:
+        return fol_agent.readKnowledgeBase(f, snapshot)
+
+@pytest.mark.parametrize("engine", ["given_clause", "rete", "sat"])
+def test_snapshot_answers_like_the_kb(engine, tmp_path):
+    snapshot = str(tmp_path / "kb.snapshot")
+    write_kb_section(tmp_path / "kb.txt", README_KB)
+    (KB, var_map) = read_kb_section(tmp_path / "kb.txt", snapshot)
+    assert not isinstance(KB, fol_agent.MappedKnowledgeBase)
+    (mapped, mapped_var_map) = read_kb_section(tmp_path / "kb.txt", snapshot)
+    assert isinstance(mapped, fol_agent.MappedKnowledgeBase)
+    assert mapped_var_map == var_map
+    assert list(mapped.all_clauses()) == list(KB.all_clauses())
+    for clause in KB.all_clauses():
+        assert mapped.contains(clause)
+    assert mapped.has_fact(fol_agent.parser.parse("Mother(Liz,Charley)"))
+    assert not mapped.has_fact(fol_agent.parser.parse("Mother(Liz,Billy)"))
+    for (query, answer) in [("Ancestor(Liz,Billy)", True), ("Ancestor(Liz,Bob)", False),
+                            ("Parent(x,Billy)", True), ("~Parent(Liz,Charley)", False)]:
+        query = fol_agent.parser.parse(query)
+        assert fol_agent.resolution(mapped.overlay(), query, dict(mapped_var_map), engine) == answer
+
+def test_snapshot_finds_factorable_clauses(tmp_path):
+    snapshot = str(tmp_path / "kb.snapshot")
+    sentences = ["(P(x) | P(y))", "((R(z,y) & R(x,y)) => P(y))", "(P(x) | Q(x))", "R(A,B)"]
+    (KB, var_map) = load(sentences)
+    fol_agent.saveSnapshot(KB, var_map, snapshot)
+    mapped = fol_agent.MappedKnowledgeBase(snapshot)
+    assert set(mapped.layer_factorable()) == set(KB.layer_factorable())
+    assert len(set(KB.layer_factorable())) == 2
+
+def test_snapshot_is_rebuilt_for_other_sentences(tmp_path):
+    snapshot = str(tmp_path / "kb.snapshot")
+    write_kb_section(tmp_path / "kb.txt", ["P(A)"])
+    read_kb_section(tmp_path / "kb.txt", snapshot)
+    write_kb_section(tmp_path / "kb.txt", ["Q(A)"])
+    (KB, var_map) = read_kb_section(tmp_path / "kb.txt", snapshot)
+    assert not isinstance(KB, fol_agent.MappedKnowledgeBase)
+    (KB, var_map) = read_kb_section(tmp_path / "kb.txt", snapshot)
+    assert isinstance(KB, fol_agent.MappedKnowledgeBase)
+    assert not KB.has_fact(fol_agent.parser.parse("P(A)"))
+    assert KB.has_fact(fol_agent.parser.parse("Q(A)"))
+
+def test_unreadable_snapshot_is_rebuilt(tmp_path):
+    snapshot = tmp_path / "kb.snapshot"
+    snapshot.write_bytes(b"FOLKB001 from an older version")
+    write_kb_section(tmp_path / "kb.txt", ["P(A)"])
+    (KB, var_map) = read_kb_section(tmp_path / "kb.txt", str(snapshot))
+    assert not isinstance(KB, fol_agent.MappedKnowledgeBase)
+    assert fol_agent.snapshotDigest(str(snapshot)) == fol_agent.kbDigest(1, ["P(A)"])
+
+
+# ------------------  symbol table  --------------------------
+
+def test_symbol_ids_round_trip():
+    table = fol_agent.SymbolTable()
+    names = ["x", "y", "x1", "x12", "y12", "z999", "Parent", "Liz", "Ancestor"]
+    codes = [table.code(name) for name in names]
+    assert len(set(codes)) == len(names)
+    for (name, code) in zip(names, codes):
+        assert table.code(name) == code
+        assert table.name(code) == name
+        assert (code < 0) == name.islower()
+    assert table.base(table.code("x12")) == "x"
+
+def test_fresh_variables_are_not_kept():
+    (KB, var_map) = load(README_KB)
+    query = fol_agent.parser.parse("Ancestor(Liz,Bob)")
+    fol_agent.resolution(KB.overlay(), query, var_map, "given_clause")
+    size = (len(fol_agent.symbols.names), len(fol_agent.symbols.bases))
+    for i in range(3):
+        fol_agent.resolution(KB.overlay(), query, var_map, "given_clause")
+    assert (len(fol_agent.symbols.names), len(fol_agent.symbols.bases)) == size
+
+
+# ------------------  parsers  --------------------------
+
+@pytest.mark.parametrize("seed", range(300))
+def test_parsers_agree_on_sentences(seed):
+    sentence = random_formula(random.Random(seed), 5)
+    for text in [sentence, sentence.replace(" ", ""), "(%s => R(x,y))" % sentence]:
+        rd_result = fol_agent.RecursiveDescentParser().parse(text)
+        assert rd_result is not None
+        assert fol_agent.ply_parser.parse(text) == rd_result
+        assert fol_agent.CheckedParser().parse(text) == rd_result
+
+@pytest.mark.parametrize("text", ["(P(x) Q(x))", "", "P(A)))", "(P(A) & Q(B)", "P(A,)"])
+def test_parsers_reject_malformed_sentences(text):
+    assert fol_agent.ply_parser.parse(text) is None
+    assert fol_agent.RecursiveDescentParser().parse(text) is None
+
+def test_ply_is_the_default_parser():
+    assert fol_agent.make_parser() is fol_agent.ply_parser
+
+def lex_types(lexer, text):
+    lexer.input(text)
+    return [token.type for token in iter(lexer.token, None)]
+
+def test_stale_lexer_table_is_rebuilt(tmp_path, monkeypatch):
+    stale = types.ModuleType("fol_lextab")
+    stale.__dict__.update(vars(sys.modules["fol_lextab"]))
+    stale._lexsignature = "stale"
+    stale._lexstatere = {"INITIAL": [("(?P<t_FACTOR>[A-z]+)", [None, (None, "FACTOR")])]}
+    monkeypatch.setitem(sys.modules, "fol_lextab", stale)
+    monkeypatch.setattr(fol_agent, "__file__", str(tmp_path / "fol_agent.py"))
+    lexer = fol_agent.buildLexer()
+    assert lex_types(lexer, "(~P(x) => Q)") == ["LPAREN", "NOT", "FACTOR", "LPAREN", "FACTOR",
+                                               "RPAREN", "IMPLY", "FACTOR", "RPAREN"]
+    rebuilt = (tmp_path / "fol_lextab.py").read_text()
+    assert "_lexsignature = %r" % fol_agent.lexerSignature() in rebuilt
+
+
+# ------------------  materializing engines  --------------------------
+
+def chain(count):
+    names = ["N" + "".join([chr(ord("a") + (i // 26 ** k) % 26) for k in range(3)]) for i in range(count + 1)]
+    sentences = ["Parent(%s,%s)" % (names[i], names[i + 1]) for i in range(count)]
+    sentences.append("(Parent(x,y) => Ancestor(x,y))")
+    sentences.append("((Parent(x,y) & Ancestor(y,z)) => Ancestor(x,z))")
+    return (sentences, names)
+
+def test_rete_retract_undoes_assume():
+    (KB, var_map) = load(["(P(x) => Q(x))", "((Q(x) & R(x)) => S(x))", "(S(x) => (~T(x)))", "R(A)", "R(B)", "T(B)"])
+    network = fol_agent.reteNetwork(KB)
+    facts = set(network.facts)
+    memories = [[dict((key, list(items)) for (key, items) in memory.items())
+                 for memory in rule.alpha + rule.beta] for rule in network.rules]
+    assert network.assume(fol_agent.parser.parse("P(A)")) is True
+    assert fol_agent.parser.parse("S(A)") in network.facts
+    assert not network.inconsistent
+    network.retract()
+    assert network.facts == facts
+    assert [[dict((key, items) for (key, items) in memory.items() if items)
+             for memory in rule.alpha + rule.beta] for rule in network.rules] == \
+           [[dict((key, items) for (key, items) in memory.items() if items)
+             for memory in rule_memories] for rule_memories in memories]
+    network.assume(fol_agent.parser.parse("P(B)"))
+    assert network.inconsistent
+    network.retract()
+    assert not network.inconsistent and network.facts == facts
+    query = fol_agent.parser.parse("~P(B)")
+    assert fol_agent.resolution(KB.overlay(), query, var_map, "rete") is True
+    assert network.facts == facts
+
+@pytest.mark.parametrize("engine", ["rete", "datalog", "sat"])
+def test_materialization_past_deadline_falls_back(engine):
+    (sentences, names) = chain(40)
+    (KB, var_map) = load(sentences)
+    fol_agent.prepareResolution(KB, var_map, engine, 0)
+    assert KB.cache[engine] is None
+    query = fol_agent.parser.parse("Ancestor(%s,%s)" % (names[0], names[3]))
+    assert fol_agent.resolution(KB.overlay(), query, var_map, engine) is True
+
+# a proof along the chain grounds one rule instance per link, not the
+# instances of every rule each fact on the way matches
+def test_sat_grounding_follows_the_proof():
+    (sentences, names) = chain(400)
+    sentences.append("(Ancestor(x,y) => (~Stop(x,y)))")
+    (KB, var_map) = load(sentences)
+    fol_agent.prepareResolution(KB, var_map, "sat")
+    program = KB.cache["sat"]
+    negated = Clause([fol_agent.parser.parse("~Ancestor(%s,%s)" % (names[0], names[-1]))])
+    assert len(program.relevant([negated], fol_agent.time.time() + 60)) < 3 * len(names)
+    query = fol_agent.parser.parse("~Stop(%s,%s)" % (names[0], names[-1]))
+    assert fol_agent.resolution(KB.overlay(), query, var_map, "sat") is True
+
+# queries outside the shared grounding extend it or are answered from the
+# model, and an assumed atom is taken back
+def test_sat_queries_share_one_grounding():
+    (sentences, names) = chain(20)
+    sentences.append("(Ancestor(x,y) => (~Stop(x,y)))")
+    sentences.append("Friend(x,Zoe)")
+    (KB, var_map) = load(sentences)
+    fol_agent.prepareResolution(KB, var_map, "sat")
+    program = KB.cache["sat"]
+    sizes = dict((key, relation.size) for (key, relation) in program.model.relations.items())
+    for (query, answer) in [("~Parent(%s,%s)" % (names[1], names[0]), False),
+                            ("~Stop(%s,%s)" % (names[0], names[-1]), True),
+                            ("Ancestor(%s,Zed)" % names[0], False),
+                            ("~Stop(%s,Zed)" % names[0], False),
+                            ("Friend(Zed,Zoe)", True)]:
+        assert fol_agent.resolution(KB.overlay(), fol_agent.parser.parse(query), var_map, "sat") is answer
+    assert KB.cache["sat"] is program and "Zed" in program.universe
+    for key in sizes:
+        if key[0] != "$U" and key[0] != "Friend":
+            assert program.model.relations[key].size == sizes[key]
+
+def test_relation_lookup_is_a_snapshot():
+    relation = fol_agent.Relation(2)
+    relation.add(("A", "B"))
+    rids = relation.lookup((0,), ("A",), 0, relation.size)
+    relation.add(("A", "C"))
+    assert list(rids) == [0]
+    assert list(relation.lookup((0,), ("A",), 0, relation.size)) == [0, 1]
+    assert list(relation.lookup((0,), ("A",), 1, relation.size)) == [1]
+    relation.truncate(1)
+    assert list(relation.lookup((0,), ("A",), 0, relation.size)) == [0]
+
+def test_datalog_rounds_read_their_own_ranges():
+    (sentences, names) = chain(30)
+    (KB, var_map) = load(sentences)
+    program = fol_agent.datalogProgram(KB)
+    ancestors = program.relations[("Ancestor", 2)]
+    assert ancestors.size == len(ancestors.rows) == 31 * 30 // 2
+    query = fol_agent.parser.parse("Ancestor(%s,%s)" % (names[0], names[30]))
+    assert fol_agent.resolution(KB.overlay(), query, var_map, "datalog") is True
+
+
+# ------------------  tabling  --------------------------
+
+HORN_PREDICATES = [("P", 1), ("Q", 2), ("R", 2), ("S", 1)]
+
+def random_atom(rng, arguments, predicates = HORN_PREDICATES):
+    (name, arity) = rng.choice(predicates)
+    return "%s(%s)" % (name, ",".join([rng.choice(arguments) for i in range(arity)]))
+
+# random recursive Horn KB over the constants A, B and C, with a few rules
+# without a head
+def random_horn_kb(rng):
+    sentences = [random_atom(rng, ["A", "B", "C"]) for i in range(rng.randint(2, 6))]
+    for i in range(rng.randint(2, 6)):
+        body = [random_atom(rng, ["x", "y", "z", "A"]) for k in range(rng.randint(1, 3))]
+        variables = sorted(set([arg for atom in body for arg in atom[2:-1].split(",") if arg.islower()]))
+        (name, arity) = rng.choice(HORN_PREDICATES)
+        head = "%s(%s)" % (name, ",".join([rng.choice(variables + ["B"]) for k in range(arity)]))
+        if rng.random() < 0.15:
+            head = "(~%s)" % head
+        conjunction = body[0]
+        for atom in body[1:]:
+            conjunction = "(%s & %s)" % (conjunction, atom)
+        sentences.append("(%s => %s)" % (conjunction, head))
+    return sentences
+
+def ground_atoms():
+    for (name, arity) in HORN_PREDICATES:
+        for arguments in itertools.product(["A", "B", "C"], repeat=arity):
+            yield "%s(%s)" % (name, ",".join(arguments))
+
+@pytest.mark.parametrize("seed", range(100))
+def test_tabling_agrees_with_datalog(seed):
+    sentences = random_horn_kb(random.Random(seed))
+    (KB, var_map) = load(sentences)
+    program = fol_agent.tabledProgram(KB)
+    datalog = fol_agent.datalogProgram(KB)
+    assert program is not None and datalog is not None
+    # the tables of earlier queries answer the later ones
+    for atom in ground_atoms():
+        atom = fol_agent.parser.parse(atom)
+        if datalog.inconsistent:
+            assert program.holds(atom)
+            continue
+        assert program.holds(atom) == datalog.holds(atom), (sentences, atom)
+        assert program.refutes(atom) == datalog.refutes(atom), (sentences, atom)
+    assert all(table.complete for table in program.tables.values())
+    assert program.stack == [] and program.incomplete == []
+
+def test_tabling_mutual_recursion():
+    sentences = ["E(A,B)", "E(B,C)", "E(C,A)", "E(C,D)",
+                 "(E(x,y) => Odd(x,y))", "((E(x,y) & Even(y,z)) => Odd(x,z))",
+                 "((E(x,y) & Odd(y,z)) => Even(x,z))"]
+    assert ask(sentences, "Even(A,C)", "tabling") is True
+    assert ask(sentences, "Odd(A,D)", "tabling") is True
+    assert ask(sentences, "Even(A,D)", "tabling") is True
+    assert ask(sentences, "Odd(D,A)", "tabling") is False
+
+def test_tabling_long_chain_keeps_recursion_limit():
+    limit = fol_agent.sys.getrecursionlimit()
+    (sentences, names) = chain(3 * limit)
+    assert ask(sentences, "Ancestor(%s,%s)" % (names[0], names[-1]), "tabling") is True
+    assert fol_agent.sys.getrecursionlimit() == limit
+
+# the call Ancestor(x0,y) reads its own answers before they are complete
+def test_tabling_left_recursion():
+    (sentences, names) = chain(6)
+    sentences[-1] = "((Ancestor(x,y) & Parent(y,z)) => Ancestor(x,z))"
+    for i in range(1, 7):
+        assert ask(sentences, "Ancestor(%s,%s)" % (names[0], names[i]), "tabling") is True
+    assert ask(sentences, "Ancestor(%s,%s)" % (names[3], names[1]), "tabling") is False
+
+# the tables left incomplete past the deadline are dropped, not kept with
+# some of their answers
+def test_tabling_past_deadline_keeps_only_complete_tables():
+    (sentences, names) = chain(60)
+    sentences.append("(Ancestor(x,y) => (~Stop(x,y)))")
+    (KB, var_map) = load(sentences)
+    program = fol_agent.tabledProgram(KB)
+    query = fol_agent.parser.parse("Stop(%s,%s)" % (names[0], names[-1]))
+    assert program.refutes(query, 0) is None
+    assert program.consistent is None
+    assert all(table.complete for table in program.tables.values())
+    assert program.refutes(query) is True
+    assert program.holds(fol_agent.parser.parse("Ancestor(%s,%s)" % (names[0], names[-1]))) is True
+
+
+# ------------------  answering queries  --------------------------
+
+# make sentences the KB of answerQuery and answerQueries, with a fresh
+# lemma cache
+def use_kb(monkeypatch, sentences):
+    (KB, var_map) = load(sentences)
+    monkeypatch.setattr(fol_agent, "KB_map", KB)
+    monkeypatch.setattr(fol_agent, "var_map", var_map)
+    monkeypatch.setattr(fol_agent, "lemmas", fol_agent.LemmaCache())
+
+def test_lemma_cache_evicts_least_recently_used():
+    lemmas = fol_agent.LemmaCache(2)
+    (p, q, r) = [fol_agent.parser.parse(s) for s in ["P(A)", "Q(A)", "R(A)"]]
+    lemmas.put(p, True)
+    lemmas.put(q, False)
+    assert lemmas.get(p) is True
+    lemmas.put(r, True)
+    assert lemmas.get(q) is None
+    assert lemmas.get(p) is True and lemmas.get(r) is True
+
+def test_lemma_cache_hits_variants():
+    lemmas = fol_agent.LemmaCache()
+    lemmas.put(fol_agent.parser.parse("Ancestor(x,y)"), True)
+    assert lemmas.get(fol_agent.parser.parse("Ancestor(u,v)")) is True
+    assert lemmas.get(fol_agent.parser.parse("Ancestor(u,u)")) is None
+    assert lemmas.get(fol_agent.parser.parse("~Ancestor(u,v)")) is None
+
+def test_answer_query_keeps_false_only_within_time_limit(monkeypatch):
+    use_kb(monkeypatch, README_KB)
+    query = fol_agent.parser.parse("Ancestor(Liz,Bob)")
+    monkeypatch.setattr(fol_agent, "TIME_LIMIT", -1)
+    assert fol_agent.answerQuery("Ancestor(Liz,Bob)") is False
+    assert fol_agent.lemmas.get(query) is None
+    monkeypatch.setattr(fol_agent, "TIME_LIMIT", 2)
+    assert fol_agent.answerQuery("Ancestor(Liz,Bob)") is False
+    assert fol_agent.lemmas.get(query) is False
+    assert fol_agent.answerQuery("Ancestor(x,Billy)") is True
+    monkeypatch.setattr(fol_agent, "resolution", None)
+    assert fol_agent.answerQuery("Ancestor(y,Billy)") is True
+
+def test_answer_queries_in_input_order(monkeypatch):
+    use_kb(monkeypatch, README_KB)
+    answers = {"Ancestor(Liz,Billy)": True, "Ancestor(Billy,Liz)": False,
+               "Parent(Charley,Billy)": True, "Parent(Liz,Charley)": True,
+               "Mother(Liz,x)": True, "Ancestor(Liz,Bob)": False}
+    queries = [q for i in range(3) for q in sorted(answers, key=lambda q: hash((i, q)))]
+    assert list(fol_agent.answerQueries(queries, 4)) == [answers[q] for q in queries]